@@ -0,0 +1,216 @@
+import argparse
+import csv
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from scheduler import BACKFILL
+from model import flat_to_dataframe
+from flat_format import FlatColumns, FlatMenuWriter
+from postprocess import postprocess_menu
+from incremental import IncrementalExtractor
+
+
+def load_manifest(path):
+    """Loads a manifest of restaurant id -> menu URLs from a JSONL or CSV file.
+
+    JSONL lines look like {"restaurant_id": "...", "urls": ["...", ...]} ("url" is accepted for a single link).
+    CSV files need a restaurant_id column and a url column; a restaurant may span several rows,
+    or list several links in one cell separated by whitespace or "|".
+    Returns a list of (restaurant_id, urls) in the order restaurants first appear.
+    """
+    menus = {}
+
+    def add(restaurant_id, urls):
+        restaurant_id = str(restaurant_id).strip()
+        if not restaurant_id:
+            return
+        menus.setdefault(restaurant_id, [])
+        for url in urls:
+            url = url.strip()
+            if url and url not in menus[restaurant_id]:
+                menus[restaurant_id].append(url)
+
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith(".csv"):
+            for row in csv.DictReader(f):
+                cell = row.get("urls") or row.get("url") or ""
+                add(row.get("restaurant_id", ""), re.split(r"[\s|]+", cell))
+        else:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                urls = record.get("urls") or [record.get("url", "")]
+                add(record.get("restaurant_id", ""), urls)
+
+    return [(restaurant_id, urls) for restaurant_id, urls in menus.items() if urls]
+
+
+def safe_filename(restaurant_id):
+    """Maps a restaurant id onto a file name that is safe on every platform."""
+    return re.sub(r"[^A-Za-z0-9._-]", "_", restaurant_id)
+
+
+class BatchRunner:
+    """Runs menuBuilder over many restaurants with a bounded worker pool.
+
+    Each restaurant goes through three stages (fetch, preprocess, LLM call). Every stage has its own cap
+    on in-flight work, so slow downloads or CPU heavy preprocessing never starve the model endpoint,
+    and the number of concurrent get_response calls stays within what the account can take.
+    With a dataset (FlatMenuWriter), the flat rows of every restaurant are also appended to one file.
+    With a store (ExtractionStore), only new or changed pages are extracted, and the summary reports
+    the items added, removed and repriced since the last run.
+    """
+
+    def __init__(self, builder, output_dir, max_workers=32, fetch_concurrency=16, preprocess_concurrency=None,
+                 llm_concurrency=8, skip_existing=False, dataset=None, store=None):
+        self.builder = builder
+        self.incremental = IncrementalExtractor(builder, store) if store is not None else None
+        self.output_dir = output_dir
+        self.dataset = dataset
+        self.max_workers = max_workers
+        self.skip_existing = skip_existing
+        self.fetch_slots = threading.BoundedSemaphore(fetch_concurrency)
+        self.preprocess_slots = threading.BoundedSemaphore(preprocess_concurrency or os.cpu_count() or 1)
+        self.llm_slots = threading.BoundedSemaphore(llm_concurrency)
+        self.summary_lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+
+    def output_paths(self, restaurant_id):
+        base = os.path.join(self.output_dir, safe_filename(restaurant_id))
+        return base + ".json", base + ".csv"
+
+    def process_restaurant(self, restaurant_id, urls):
+        """Builds the menu of one restaurant and writes its outputs as soon as it finishes.
+
+        Returns the stage timings and, in incremental mode, the diff against the last run.
+        """
+        builder = self.builder
+        timings = {}
+        diff = None
+
+        start = time.perf_counter()
+        with self.fetch_slots:
+            fetched = builder.fetch_inputs(urls)
+        timings["fetch"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with self.preprocess_slots:
+            base64_images = builder.preprocess_inputs(fetched)
+        timings["preprocess"] = time.perf_counter() - start
+
+        del fetched
+
+        start = time.perf_counter()
+        with self.llm_slots:
+            if self.incremental is not None:
+                prediction, diff = self.incremental.extract(restaurant_id, base64_images, priority=BACKFILL)
+            else:
+                prediction = builder.extract(base64_images, priority=BACKFILL, restaurant_id=restaurant_id)
+        timings["llm"] = time.perf_counter() - start
+
+        self.write_outputs(restaurant_id, prediction)
+        return timings, diff
+
+    def write_outputs(self, restaurant_id, prediction):
+        """Stores the raw model response and the post-processed flat menu of one restaurant."""
+        json_path, csv_path = self.output_paths(restaurant_id)
+        output_json = json.loads(prediction)
+
+        # post-processing (validation, cleaning and flattening in one pass)
+        flat = FlatColumns()
+        postprocess_menu(output_json.get("menu_output") or {}, flat, restaurant_id)
+        flat_to_dataframe(flat).to_csv(csv_path + ".tmp", index=False)
+        os.replace(csv_path + ".tmp", csv_path)
+        if self.dataset is not None:
+            self.dataset.write_columns(flat)
+
+        # the JSON file is written last, so its presence marks a finished restaurant
+        with open(json_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(output_json, f, ensure_ascii=False)
+        os.replace(json_path + ".tmp", json_path)
+
+    def record(self, summary_file, entry):
+        with self.summary_lock:
+            summary_file.write(json.dumps(entry) + "\n")
+            summary_file.flush()
+
+    def run(self, manifest):
+        """Processes every (restaurant_id, urls) entry and returns the number of failures."""
+        pending = manifest
+        if self.skip_existing:
+            pending = [(rid, urls) for rid, urls in manifest if not os.path.exists(self.output_paths(rid)[0])]
+
+        failures = 0
+        summary_path = os.path.join(self.output_dir, "summary.jsonl")
+        with open(summary_path, "a", encoding="utf-8") as summary_file, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self.process_restaurant, rid, urls): rid for rid, urls in pending}
+            for future in as_completed(futures):
+                restaurant_id = futures[future]
+                try:
+                    timings, diff = future.result()
+                    entry = {"restaurant_id": restaurant_id, "status": "ok", "timings": timings}
+                    if diff is not None:
+                        entry["diff"] = diff
+                    self.record(summary_file, entry)
+                except Exception as e:
+                    failures += 1
+                    self.record(summary_file, {"restaurant_id": restaurant_id, "status": "error", "error": repr(e)})
+
+        return failures
+
+
+def add_arguments(parser):
+    parser.add_argument("manifest", help="JSONL or CSV file of restaurant_id -> menu URLs")
+    parser.add_argument("--output-dir", default="batch_output")
+    parser.add_argument("--max-workers", type=int, default=32)
+    parser.add_argument("--fetch-concurrency", type=int, default=16)
+    parser.add_argument("--preprocess-concurrency", type=int, default=None)
+    parser.add_argument("--llm-concurrency", type=int, default=8)
+    parser.add_argument("--skip-existing", action="store_true", help="skip restaurants that already have output")
+    parser.add_argument("--sharded", action="store_true", help="send each page (group) as its own model call")
+    parser.add_argument("--pages-per-shard", type=int, default=1)
+    parser.add_argument("--metrics-file", help="write Prometheus-format pipeline metrics to this file when done")
+    parser.add_argument("--dataset", help="also write the flat rows of all restaurants to one .parquet, .arrow or .csv file "
+                                          "(restaurants skipped by --skip-existing are not included)")
+    parser.add_argument("--store", help="SQLite file of earlier page results; only new or changed pages are extracted")
+
+
+def main(args):
+    """Runs a batch from parsed command line arguments; returns the number of failed restaurants."""
+    from model import create_menu_builder, create_extraction_store
+    from metrics import metrics
+
+    if args.metrics_file:
+        metrics.enabled = True
+
+    builder = create_menu_builder(sharded=args.sharded, pages_per_shard=args.pages_per_shard,
+                                  process_workers=os.cpu_count() or 1)
+    dataset = FlatMenuWriter(args.dataset) if args.dataset else None
+    store = create_extraction_store(args.store) if args.store else None
+    runner = BatchRunner(builder, args.output_dir, max_workers=args.max_workers,
+                         fetch_concurrency=args.fetch_concurrency, preprocess_concurrency=args.preprocess_concurrency,
+                         llm_concurrency=args.llm_concurrency, skip_existing=args.skip_existing, dataset=dataset,
+                         store=store)
+    manifest = load_manifest(args.manifest)
+    try:
+        failures = runner.run(manifest)
+    finally:
+        if dataset is not None:
+            dataset.close()
+    if args.metrics_file:
+        metrics.write_prometheus(args.metrics_file)
+    print("processed {} restaurants, {} failed".format(len(manifest), failures))
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build menus for every restaurant in a manifest.")
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,331 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+from prompt_prefix import write_api_body
+
+
+logger = logging.getLogger(__name__)
+
+CHAT_COMPLETIONS_URL = "/v1/chat/completions"
+# the batch API takes up to 50,000 requests and 200 MB per input file; files are rolled over
+# below the byte limit, leaving room for the request that crosses it
+MAX_REQUESTS_PER_FILE = 50_000
+MAX_BYTES_PER_FILE = 150 * 1024 * 1024
+# batch states after which a job does not change any more
+TERMINAL_STATES = {"completed", "failed", "expired", "cancelled"}
+
+
+def write_request_line(f, custom_id, params):
+    """Writes one chat completion request as a line of a batch input file."""
+    f.write('{"custom_id": ' + json.dumps(custom_id) + ', "method": "POST", "url": "' + CHAT_COMPLETIONS_URL + '", "body": ')
+    write_api_body(f, params)
+    f.write("}\n")
+
+
+def response_content(result):
+    """Returns the message content of a line of a batch output file; raises ValueError if the request failed."""
+    response = result.get("response") or {}
+    if result.get("error") or response.get("status_code") != 200:
+        raise ValueError(f"batch request failed: {result.get('error') or response.get('body')}")
+    return response["body"]["choices"][0]["message"]["content"]
+
+
+class OpenAIBatchBackend:
+    """Runs request files through the OpenAI batch API (cheaper, results within the completion window)."""
+
+    def __init__(self, client, completion_window="24h"):
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, path):
+        """Uploads a request file and starts a batch on it; returns the batch id."""
+        with open(path, "rb") as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(input_file_id=uploaded.id, endpoint=CHAT_COMPLETIONS_URL,
+                                           completion_window=self.completion_window)
+        return batch.id
+
+    def status(self, job_id):
+        return self.client.batches.retrieve(job_id).status
+
+    def download(self, job_id, path):
+        """Writes the output lines of a finished batch, and the lines of its failed requests, to path."""
+        batch = self.client.batches.retrieve(job_id)
+        with open(path, "wb") as f:
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    with self.client.files.with_streaming_response.content(file_id) as response:
+                        for chunk in response.iter_bytes():
+                            f.write(chunk)
+
+
+class LocalBatchBackend:
+    """Stand-in for the batch API, for testing: runs the requests of a file right away through a chat
+    completions client (e.g. one pointed at benchmark.MockChatServer) and keeps the output, in the
+    format of the batch API, in output_dir.
+    """
+
+    def __init__(self, client, output_dir, max_workers=8):
+        self.client = client
+        self.output_dir = output_dir
+        self.max_workers = max_workers
+        os.makedirs(output_dir, exist_ok=True)
+
+    def output_path(self, job_id):
+        return os.path.join(self.output_dir, job_id + ".jsonl")
+
+    def submit(self, path):
+        job_id = "local-" + os.path.splitext(os.path.basename(path))[0]
+        output_path = self.output_path(job_id)
+        with open(path, encoding="utf-8") as f, open(output_path + ".tmp", "w", encoding="utf-8") as out, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            # a few requests at a time, so the file is never held in memory
+            while True:
+                lines = list(itertools.islice(f, self.max_workers * 2))
+                if not lines:
+                    break
+                for result in pool.map(self.run_request, lines):
+                    out.write(json.dumps(result) + "\n")
+        os.replace(output_path + ".tmp", output_path)
+        return job_id
+
+    def run_request(self, line):
+        request = json.loads(line)
+        try:
+            completion = self.client.chat.completions.create(**request["body"])
+        except Exception as e:
+            return {"custom_id": request["custom_id"], "response": None, "error": {"message": repr(e)}}
+        return {"custom_id": request["custom_id"], "response": {"status_code": 200, "body": completion.model_dump()},
+                "error": None}
+
+    def status(self, job_id):
+        return "completed" if os.path.exists(self.output_path(job_id)) else "failed"
+
+    def download(self, job_id, path):
+        shutil.copyfile(self.output_path(job_id), path)
+
+
+class BatchJob:
+    """An offline extraction job over many restaurants, run through a batch backend and resumable at any point.
+
+    Each run of the job picks up where the last one stopped:
+    prepare() writes the messages of generate_gpt_messages for the restaurants that are neither finished
+    nor in a submitted file to batch input files (JSONL, one request per restaurant), submit() hands the
+    new files to the backend, poll() downloads the output of the batches that have ended, and collect()
+    post-processes the results through write_outputs(restaurant_id, response) (e.g. BatchRunner.write_outputs).
+
+    The state of every file and the finished restaurants are kept in work_dir/job.json, saved after
+    every step. Restaurants that failed, or got no result from an expired batch, are prepared again on
+    the next run. Requests go out as plain extractions: triage, sharding and the caches are not used.
+    """
+
+    def __init__(self, builder, work_dir, backend, write_outputs, requests_per_file=MAX_REQUESTS_PER_FILE,
+                 bytes_per_file=MAX_BYTES_PER_FILE, max_workers=16):
+        self.builder = builder
+        self.work_dir = work_dir
+        self.backend = backend
+        self.write_outputs = write_outputs
+        self.requests_per_file = requests_per_file
+        self.bytes_per_file = bytes_per_file
+        self.max_workers = max_workers
+        self.state_path = os.path.join(work_dir, "job.json")
+        os.makedirs(work_dir, exist_ok=True)
+
+        self.files = {}  # input file name -> {"status", "restaurants", "job_id", "batch_status"}
+        self.done = set()
+        self.errors = {}  # restaurant id -> last error
+        if os.path.exists(self.state_path):
+            with open(self.state_path, encoding="utf-8") as f:
+                state = json.load(f)
+            self.files = state["files"]
+            self.done = set(state["done"])
+            self.errors = state["errors"]
+
+    def save(self):
+        state = {"files": self.files, "done": sorted(self.done), "errors": self.errors}
+        with open(self.state_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def in_flight(self):
+        """The restaurants of files whose results have not been collected yet."""
+        return {rid for entry in self.files.values() if entry["status"] != "collected" for rid in entry["restaurants"]}
+
+    def request_params(self, messages):
+        agent = self.builder.chat_agent
+        return {"model": agent.model_name, "messages": messages, "temperature": agent.temperature,
+                "response_format": agent.response_format}
+
+    def build_request(self, restaurant_id, urls):
+        builder = self.builder
+        try:
+            messages = builder.generate_gpt_messages(builder.system_instruction_prompt, builder.menu_extraction_prompt,
+                                                     builder.extraction_examples, urls)
+        except Exception as e:
+            logger.warning("could not prepare restaurant %s: %r", restaurant_id, e)
+            return restaurant_id, None, e
+        return restaurant_id, self.request_params(messages), None
+
+    def prepare(self, manifest):
+        """Writes the requests of the pending restaurants to new input files; returns the number written."""
+        skip = self.done | self.in_flight()
+        pending = [(rid, urls) for rid, urls in manifest if rid not in skip]
+        written = 0
+        f, name, restaurants = None, None, []
+
+        def close():
+            f.close()
+            path = os.path.join(self.work_dir, name)
+            os.replace(path + ".tmp", path)
+            self.files[name] = {"status": "written", "restaurants": restaurants}
+            self.save()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            # fetched and preprocessed a few restaurants ahead, so requests are never all in memory
+            for start in range(0, len(pending), self.max_workers * 2):
+                chunk = pending[start:start + self.max_workers * 2]
+                for restaurant_id, params, error in pool.map(lambda entry: self.build_request(*entry), chunk):
+                    if error is not None:
+                        self.errors[restaurant_id] = repr(error)
+                        continue
+                    if f is None:
+                        name, restaurants = "requests-{:05d}.jsonl".format(len(self.files)), []
+                        f = open(os.path.join(self.work_dir, name + ".tmp"), "w", encoding="utf-8")
+                    write_request_line(f, restaurant_id, params)
+                    restaurants.append(restaurant_id)
+                    written += 1
+                    if len(restaurants) >= self.requests_per_file or f.tell() >= self.bytes_per_file:
+                        close()
+                        f = None
+        if f is not None:
+            close()
+        self.save()
+        return written
+
+    def submit(self):
+        """Hands the written input files to the backend."""
+        for name, entry in self.files.items():
+            if entry["status"] == "written":
+                entry["job_id"] = self.backend.submit(os.path.join(self.work_dir, name))
+                entry["status"] = "submitted"
+                self.save()
+                metrics.count("menu_batch_files_total", status="submitted")
+                logger.info("submitted %s (%d requests) as %s", name, len(entry["restaurants"]), entry["job_id"])
+
+    def poll(self):
+        """Downloads the output of the submitted batches that have ended; returns the number still running."""
+        running = 0
+        for name, entry in self.files.items():
+            if entry["status"] != "submitted":
+                continue
+            status = self.backend.status(entry["job_id"])
+            if status not in TERMINAL_STATES:
+                running += 1
+                continue
+            path = os.path.join(self.work_dir, name.replace("requests-", "results-"))
+            self.backend.download(entry["job_id"], path + ".tmp")
+            os.replace(path + ".tmp", path)
+            entry["status"], entry["batch_status"] = "downloaded", status
+            self.save()
+            metrics.count("menu_batch_files_total", status=status)
+        return running
+
+    def collect(self):
+        """Post-processes the downloaded results; returns the number of restaurants finished."""
+        finished = 0
+        for name, entry in self.files.items():
+            if entry["status"] != "downloaded":
+                continue
+            with open(os.path.join(self.work_dir, name.replace("requests-", "results-")), encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    result = json.loads(line)
+                    restaurant_id = result["custom_id"]
+                    try:
+                        self.write_outputs(restaurant_id, response_content(result))
+                    except Exception as e:
+                        self.errors[restaurant_id] = repr(e)
+                        metrics.count("menu_batch_requests_total", result="error")
+                        continue
+                    self.done.add(restaurant_id)
+                    self.errors.pop(restaurant_id, None)
+                    metrics.count("menu_batch_requests_total", result="ok")
+                    finished += 1
+            entry["status"] = "collected"
+            self.save()
+        return finished
+
+    def run(self, manifest, wait=False, poll_interval=60):
+        """Prepares, submits and collects what it can; with wait, polls until every submitted batch has ended."""
+        self.prepare(manifest)
+        self.submit()
+        while True:
+            running = self.poll()
+            self.collect()
+            if not running or not wait:
+                return running
+            time.sleep(poll_interval)
+
+
+def add_arguments(parser):
+    parser.add_argument("manifest", help="JSONL or CSV file of restaurant_id -> menu URLs")
+    parser.add_argument("--work-dir", default="batch_job", help="request/result files and job state (job.json)")
+    parser.add_argument("--output-dir", default="batch_output")
+    parser.add_argument("--backend", choices=["openai", "local"], default="openai",
+                        help="OpenAI batch API, or run the requests right away (for testing)")
+    parser.add_argument("--wait", action="store_true", help="poll until every submitted batch has ended")
+    parser.add_argument("--poll-interval", type=float, default=60)
+    parser.add_argument("--requests-per-file", type=int, default=MAX_REQUESTS_PER_FILE)
+    parser.add_argument("--max-workers", type=int, default=16, help="restaurants fetched and preprocessed at once")
+    parser.add_argument("--metrics-file", help="write Prometheus-format pipeline metrics to this file when done")
+    parser.add_argument("--dataset", help="also write the flat rows of the restaurants collected by this run "
+                                          "to one .parquet, .arrow or .csv file")
+
+
+def main(args):
+    """Runs a batch job from parsed command line arguments; returns the number of failed restaurants."""
+    from batch import BatchRunner, load_manifest
+    from flat_format import FlatMenuWriter
+    from model import create_menu_builder
+
+    if args.metrics_file:
+        metrics.enabled = True
+
+    builder = create_menu_builder(process_workers=os.cpu_count() or 1)
+    client = builder.chat_agent.client
+    if args.backend == "openai":
+        backend = OpenAIBatchBackend(client)
+    else:
+        backend = LocalBatchBackend(client, os.path.join(args.work_dir, "local"))
+    dataset = FlatMenuWriter(args.dataset) if args.dataset else None
+    runner = BatchRunner(builder, args.output_dir, dataset=dataset)
+    job = BatchJob(builder, args.work_dir, backend, runner.write_outputs, requests_per_file=args.requests_per_file,
+                   max_workers=args.max_workers)
+    manifest = load_manifest(args.manifest)
+    try:
+        running = job.run(manifest, wait=args.wait, poll_interval=args.poll_interval)
+    finally:
+        if dataset is not None:
+            dataset.close()
+    if args.metrics_file:
+        metrics.write_prometheus(args.metrics_file)
+
+    ids = {rid for rid, _ in manifest}
+    failures = len(ids & set(job.errors))
+    print("{} of {} restaurants done, {} batches running, {} failed".format(
+        len(ids & job.done), len(manifest), running, failures))
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build menus for every restaurant in a manifest through batch jobs.")
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,478 @@
+import argparse
+import base64
+import hashlib
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import pymupdf
+from PIL import Image, ImageDraw
+
+from metrics import metrics
+from scheduler import estimate_prompt_tokens
+
+
+CANNED_CATEGORIES = 6
+CANNED_ITEMS = 12
+
+
+def canned_menu_json(categories=CANNED_CATEGORIES, items=CANNED_ITEMS):
+    """A model answer of realistic size, used by the mock chat-completions server."""
+    return json.dumps({
+        "is_valid_menu": "yes",
+        "input_quality": 80,
+        "menu_complexity": "easy",
+        "menu_output": {"categories": [
+            {"name": f"Category {c}", "subtitle": "", "sort_id": c, "items": [
+                {"name": f"Item {c}-{i}", "description": "House made, served with a side of fries",
+                 "price": 499 + 100 * i, "extras": [], "is_alcohol": False, "is_bike_friendly": True, "sort_id": i}
+                for i in range(items)]}
+            for c in range(categories)]},
+        "confidence": 90,
+    })
+
+
+# ----- menu corpus -----
+
+def menu_image(width, height, lines=40):
+    """Draws a synthetic menu page: black text lines on white."""
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    step = max(height // (lines + 2), 12)
+    for i in range(lines):
+        text = "BURGERS" if i % 10 == 0 else f"Item {i} smash burger with cheese ........ ${5 + i % 9}.99"
+        draw.text((width // 12, step * (i + 1)), text, fill="black", font_size=max(step // 2, 10))
+    return image
+
+
+def encode_image(image, image_format, exif_orientation=None):
+    buffer = BytesIO()
+    if exif_orientation:
+        exif = Image.Exif()
+        exif[0x0112] = exif_orientation
+        image.save(buffer, format=image_format, exif=exif)
+    else:
+        image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def menu_pdf(pages, scanned=False):
+    """Builds a PDF menu with a text layer, or made of page images when scanned."""
+    document = pymupdf.open()
+    for page_num in range(pages):
+        page = document.new_page()
+        if scanned:
+            page.insert_image(page.rect, stream=encode_image(menu_image(1275, 1650), "JPEG"))
+        else:
+            page.insert_text((72, 60), f"CATEGORY {page_num}", fontsize=20)
+            for i in range(40):
+                page.insert_text((72, 90 + 17 * i), f"Item {i} smash burger with cheese ........ ${5 + i % 9}.99", fontsize=11)
+    return document.tobytes()
+
+
+def build_corpus():
+    """Returns {path: (content_type, bytes)} covering the input shapes seen in production."""
+    return {
+        "/photo_12mp.jpg": ("image/jpeg", encode_image(menu_image(4000, 3000), "JPEG")),
+        "/photo_rotated_exif.jpg": ("image/jpeg", encode_image(menu_image(3000, 4000).rotate(90, expand=True), "JPEG", 6)),
+        "/photo_rotated_180.jpg": ("image/jpeg", encode_image(menu_image(2000, 2600).rotate(180), "JPEG")),
+        "/screenshot.png": ("image/png", encode_image(menu_image(1170, 2532), "PNG")),
+        "/long_strip.png": ("image/png", encode_image(menu_image(1000, 7000, lines=120), "PNG")),
+        "/menu_1p.pdf": ("application/pdf", menu_pdf(1)),
+        "/menu_4p.pdf": ("application/pdf", menu_pdf(4)),
+        "/menu_12p.pdf": ("application/pdf", menu_pdf(12)),
+        "/scanned_6p.pdf": ("application/pdf", menu_pdf(6, scanned=True)),
+    }
+
+
+# ----- local stand-ins -----
+
+class FixtureServer:
+    """Serves the menu corpus over HTTP (with ETags) on a local port."""
+
+    def __init__(self, corpus, latency=0.0):
+        self.corpus = corpus
+        self.latency = latency
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                time.sleep(server.latency)
+                if self.path not in server.corpus:
+                    self.send_error(404)
+                    return
+                content_type, body = server.corpus[self.path]
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{}".format(self.httpd.server_address[1])
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+def api_prompt_tokens(messages):
+    """Counts the prompt tokens of API-format messages like the API does: images by their tiles, not their bytes."""
+    entries = []
+    for message in messages:
+        content = message["content"]
+        if not isinstance(content, str):
+            parts = []
+            for part in content:
+                if part.get("type") == "image_url":
+                    data = part["image_url"]["url"].split(",", 1)[1]
+                    size = Image.open(BytesIO(base64.b64decode(data))).size  # reads the header only
+                    parts.append({"image": "", "size": size})
+                else:
+                    parts.append({"text": part.get("text", "")})
+            content = parts
+        entries.append({"role": message["role"], "content": content})
+    return estimate_prompt_tokens(entries)
+
+
+class MockChatServer:
+    """Answers /v1/chat/completions with canned JSON after a configurable latency (streaming supported).
+
+    Like the real API, it reports the tokens of a system message it has seen before as cached.
+    """
+
+    def __init__(self, content=None, latency=1.0, jitter=0.2, tokens_per_second=1000.0):
+        self.content = content or canned_menu_json()
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.requests = 0
+        self.seen_prefixes = set()
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                prefix = json.dumps(body["messages"][0]) if body["messages"][0]["role"] == "system" else ""
+                with server.lock:
+                    server.requests += 1
+                    cached = prefix in server.seen_prefixes
+                    server.seen_prefixes.add(prefix)
+                usage = {"prompt_tokens": api_prompt_tokens(body["messages"]),
+                         "completion_tokens": len(server.content) // 4,
+                         "prompt_tokens_details": {"cached_tokens": len(prefix) // 4 if cached else 0}}
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                time.sleep(max(server.latency + random.uniform(-server.jitter, server.jitter), 0))
+                if body.get("stream"):
+                    self.stream(body, usage)
+                else:
+                    self.reply(body, usage)
+
+            def reply(self, body, usage):
+                # non-streamed answers arrive after the whole completion has been generated
+                time.sleep(usage["completion_tokens"] / server.tokens_per_second)
+                payload = json.dumps({
+                    "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()),
+                    "model": body["model"], "usage": usage,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": server.content}}],
+                }).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def stream(self, body, usage):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                chunk_size = 64
+                for i in range(0, len(server.content), chunk_size):
+                    time.sleep(chunk_size / 4 / server.tokens_per_second)
+                    self.event(body, {"choices": [{"index": 0, "finish_reason": None,
+                                                   "delta": {"content": server.content[i:i + chunk_size]}}]})
+                self.event(body, {"choices": [], "usage": usage})
+                self.wfile.write(b"data: [DONE]\n\n")
+
+            def event(self, body, fields):
+                chunk = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": body["model"], **fields}
+                self.wfile.write(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+                self.wfile.flush()
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = "http://127.0.0.1:{}/v1".format(self.httpd.server_address[1])
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+# ----- harness -----
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its (pool) children, in MB."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return own, children
+
+
+def proc_status_mb(field):
+    """A memory field (VmRSS, VmHWM, ...) of /proc/self/status in MB, or None where there is no /proc."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_rss_peak():
+    """Resets the resident high-water mark (VmHWM) of this process; returns False where that is not supported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class PeakMemory:
+    """Peak memory of each measured function above what was in use when it started, in MB (max over calls).
+
+    "python_mb" is the tracemalloc peak of Python allocations (bytes, base64 strings, parsed JSON).
+    "rss_mb" is the growth of the resident high-water mark, reset before each call (Linux only); it
+    also counts the pixel buffers of PIL and pymupdf, which tracemalloc does not see.
+    """
+
+    def __init__(self):
+        self.peaks = {}
+
+    @contextmanager
+    def measure(self, name):
+        tracemalloc.reset_peak()
+        traced_start = tracemalloc.get_traced_memory()[0]
+        rss_start = proc_status_mb("VmRSS") if reset_rss_peak() else None
+        try:
+            yield
+        finally:
+            python_mb = (tracemalloc.get_traced_memory()[1] - traced_start) / 2 ** 20
+            rss_peak = proc_status_mb("VmHWM") if rss_start is not None else None
+            peak = self.peaks.setdefault(name, {"calls": 0, "python_mb": 0.0, "rss_mb": None})
+            peak["calls"] += 1
+            peak["python_mb"] = max(peak["python_mb"], python_mb)
+            if rss_peak is not None:
+                peak["rss_mb"] = max(peak["rss_mb"] or 0.0, rss_peak - rss_start)
+
+
+def stage_report():
+    """Collects p50/p95 per stage from the metrics registry."""
+    report = {}
+    for histogram in metrics.snapshot()["histograms"]:
+        if histogram["name"] == "menu_stage_seconds":
+            report[histogram["labels"]["stage"]] = {"count": histogram["count"], "p50": histogram["p50"],
+                                                    "p95": histogram["p95"]}
+    return report
+
+
+def bench_functions(builder, corpus, repeat):
+    """Times the preprocessing functions, json_to_flat_format and the post-processor directly on the corpus."""
+    from model import json_to_flat_format, postprocess_to_flat_format
+
+    metrics.reset()
+    menu = json.loads(canned_menu_json(categories=40, items=25))["menu_output"]
+    for _ in range(repeat):
+        for path, (content_type, body) in corpus.items():
+            if content_type == "application/pdf":
+                with metrics.span("bench_pdf_to_base64_images"):
+                    list(builder.pdf_to_base64_images(body))
+            else:
+                with metrics.span("bench_correct_image_rotation"):
+                    image = builder.correct_image_rotation(body)
+                with metrics.span("bench_image_to_base64"):
+                    builder.image_to_base64(image)
+        with metrics.span("bench_json_to_flat_format"):
+            json_to_flat_format(menu)
+        with metrics.span("bench_postprocess_to_flat_format"):
+            postprocess_to_flat_format(menu)
+    return stage_report()
+
+
+def bench_memory(builder, corpus, manifest, menus):
+    """Measures the peak memory of each preprocessing function, the flatteners and menu_builder, one call at a time.
+
+    Run apart from the latency benchmark, as tracing allocations slows every call down; builder
+    should be fresh, so the orientation cache does not skip the work.
+    """
+    from model import json_to_flat_format, postprocess_to_flat_format
+
+    memory = PeakMemory()
+    menu = json.loads(canned_menu_json(categories=40, items=25))["menu_output"]
+    tracemalloc.start()
+    try:
+        for path, (content_type, body) in corpus.items():
+            if content_type == "application/pdf":
+                with memory.measure("pdf_to_base64_images"):
+                    list(builder.pdf_to_base64_images(body))
+            else:
+                with memory.measure("correct_image_rotation"):
+                    image = builder.correct_image_rotation(body)
+                with memory.measure("image_to_base64"):
+                    builder.image_to_base64(image)
+                del image
+        with memory.measure("json_to_flat_format"):
+            json_to_flat_format(menu)
+        with memory.measure("postprocess_to_flat_format"):
+            postprocess_to_flat_format(menu)
+        for _, urls in manifest[:menus]:
+            with memory.measure("menu_builder"):
+                builder.menu_builder(urls)
+    finally:
+        tracemalloc.stop()
+    return memory.peaks
+
+
+def bench_menus(builder, manifest, concurrency):
+    """Runs menu_builder over the manifest through BatchRunner and measures throughput."""
+    from batch import BatchRunner
+
+    metrics.reset()
+    with tempfile.TemporaryDirectory() as output_dir:
+        runner = BatchRunner(builder, output_dir, max_workers=concurrency, llm_concurrency=concurrency)
+        start = time.perf_counter()
+        failures = runner.run(manifest)
+        elapsed = time.perf_counter() - start
+    return {"menus": len(manifest), "failures": failures, "seconds": elapsed,
+            "menus_per_second": len(manifest) / elapsed, "stages": stage_report()}
+
+
+# commands whose start-up time is tracked: short-lived workers pay it on every start
+COLD_START_COMMANDS = {
+    "import_model": "import model",
+    "import_cli": "import cli",
+    "create_menu_builder": "import model; model.create_menu_builder()",
+}
+
+
+def bench_cold_start(runs):
+    """Times fresh interpreters importing the pipeline; returns p50/max seconds per command."""
+    env = dict(os.environ, YOU_OPENAI_API_KEY="sk-benchmark")
+    here = os.path.dirname(os.path.abspath(__file__))
+    report = {}
+    for name, code in COLD_START_COMMANDS.items():
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], cwd=here, env=env, check=True)
+            timings.append(time.perf_counter() - start)
+        report[name] = {"runs": runs, "p50": statistics.median(timings), "max": max(timings)}
+    return report
+
+
+def build_manifest(fixture_url, corpus, menus):
+    paths = sorted(corpus)
+    manifest = []
+    for i in range(menus):
+        urls = [fixture_url + paths[i % len(paths)]]
+        if i % 3 == 0:
+            urls.append(fixture_url + paths[(i + 1) % len(paths)])
+        manifest.append((f"bench-{i}", urls))
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark with local menu hosts and a mock OpenAI API.")
+    parser.add_argument("--menus", type=int, default=24, help="restaurants per end-to-end run")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="mock time to first token in seconds")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=1000.0, help="mock output token rate")
+    parser.add_argument("--fetch-latency", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=3, help="iterations of the per-function benchmark")
+    parser.add_argument("--memory-menus", type=int, default=4, help="menus run one at a time to measure menu_builder memory")
+    parser.add_argument("--cold-start-runs", type=int, default=5, help="fresh interpreters per start-up measurement")
+    parser.add_argument("--json-out", help="also write the report as JSON to this file")
+    args = parser.parse_args()
+
+    from model import (ChatCompletionAgent, menuBuilder, system_instruction_prompt, menu_extraction_prompt,
+                       extraction_examples, temperature, response_format, model_name)
+
+    metrics.enabled = True
+    corpus = build_corpus()
+    fixtures = FixtureServer(corpus, latency=args.fetch_latency)
+    chat = MockChatServer(latency=args.llm_latency, tokens_per_second=args.llm_tokens_per_second)
+    try:
+        agent = ChatCompletionAgent(model_name, "sk-benchmark", temperature, response_format, base_url=chat.base_url)
+
+        def new_builder():
+            # a fresh builder per measurement, so no run starts with the caches (e.g. orientation) of another
+            return menuBuilder(system_instruction_prompt, menu_extraction_prompt, extraction_examples, agent)
+
+        manifest = build_manifest(fixtures.url, corpus, args.menus)
+        report = {"functions": bench_functions(new_builder(), corpus, args.repeat),
+                  "memory": bench_memory(new_builder(), corpus, manifest, args.memory_menus), "runs": {}}
+        for concurrency in args.concurrency:
+            report["runs"][concurrency] = bench_menus(new_builder(), manifest, concurrency)
+        report["peak_rss_mb"], report["peak_rss_children_mb"] = peak_rss_mb()
+        if args.cold_start_runs:
+            report["cold_start"] = bench_cold_start(args.cold_start_runs)
+    finally:
+        fixtures.close()
+        chat.close()
+
+    print("per-function latency (s):")
+    for stage, values in sorted(report["functions"].items()):
+        print("  {:32s} n={:<4d} p50={:.4f} p95={:.4f}".format(stage, values["count"], values["p50"], values["p95"]))
+    print("per-function peak memory (MB above the start of each call, max over calls):")
+    for name, values in sorted(report["memory"].items()):
+        rss = "n/a" if values["rss_mb"] is None else "{:.1f}".format(values["rss_mb"])
+        print("  {:32s} n={:<4d} python={:.1f} rss={}".format(name, values["calls"], values["python_mb"], rss))
+    for concurrency, run in report["runs"].items():
+        print("end-to-end, concurrency {}: {:.2f} menus/s ({} menus, {} failed, {:.1f}s)".format(
+            concurrency, run["menus_per_second"], run["menus"], run["failures"], run["seconds"]))
+        for stage, values in sorted(run["stages"].items()):
+            print("  {:32s} n={:<4d} p50={:.4f} p95={:.4f}".format(stage, values["count"], values["p50"], values["p95"]))
+    print("peak RSS: {:.0f} MB (pool workers: {:.0f} MB)".format(report["peak_rss_mb"], report["peak_rss_children_mb"]))
+    for name, values in report.get("cold_start", {}).items():
+        print("cold start {:24s} p50={:.3f}s max={:.3f}s".format(name, values["p50"], values["max"]))
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
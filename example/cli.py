@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+import sys
+
+import batch
+import batch_jobs
+
+
+def run(args):
+    """Builds the menu of one restaurant from URLs and/or local files."""
+    from model import create_menu_builder, create_extraction_store, postprocess_to_flat_format
+
+    builder = create_menu_builder(allow_local_files=True, sharded=args.sharded, pages_per_shard=args.pages_per_shard,
+                                  process_workers=os.cpu_count() or 1)
+    if args.store:
+        from incremental import IncrementalExtractor
+
+        if not args.restaurant_id:
+            raise SystemExit("--store needs --restaurant-id")
+        base64_images = builder.preprocess_inputs(builder.fetch_inputs(args.inputs))
+        prediction, diff = IncrementalExtractor(builder, create_extraction_store(args.store)).extract(
+            args.restaurant_id, base64_images)
+        print(json.dumps({"diff": diff}), file=sys.stderr)
+    else:
+        prediction = builder.menu_builder(args.inputs, restaurant_id=args.restaurant_id)
+    output_json = json.loads(prediction)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(output_json, f, ensure_ascii=False)
+
+    _, table = postprocess_to_flat_format(output_json.get("menu_output") or {})
+    table.to_csv(args.output or sys.stdout, index=False)
+    answers = {key: value for key, value in output_json.items() if key != "menu_output"}
+    print(json.dumps(answers), file=sys.stderr)
+    return 0
+
+
+def flatten(args):
+    """Post-processes saved model outputs into one flat dataset."""
+    from flat_format import FlatColumns, FlatMenuWriter
+    from postprocess import postprocess_menu
+
+    flat = FlatColumns()
+    with FlatMenuWriter(args.output) as writer:
+        for path in args.inputs:
+            with open(path, encoding="utf-8") as f:
+                output_json = json.load(f)
+            restaurant_id = output_json.get("restaurant_id") or os.path.splitext(os.path.basename(path))[0]
+            # either a full model output or just its menu_output
+            menu_output = output_json["menu_output"] if "menu_output" in output_json else output_json
+            flat.clear()
+            postprocess_menu(menu_output or {}, flat, restaurant_id)
+            writer.write_columns(flat)
+    print("wrote {} rows of {} menus to {}".format(writer.rows, len(args.inputs), args.output), file=sys.stderr)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="menu-builder", description="Extract structured menus from menu photos and PDFs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="build the menu of one restaurant")
+    run_parser.add_argument("inputs", nargs="+", help="menu URLs or local image/PDF files")
+    run_parser.add_argument("-o", "--output", help="flat menu CSV (default: stdout)")
+    run_parser.add_argument("--json", help="also write the raw model output to this file")
+    run_parser.add_argument("--sharded", action="store_true", help="send each page (group) as its own model call")
+    run_parser.add_argument("--pages-per-shard", type=int, default=1)
+    run_parser.add_argument("--store", help="SQLite file of earlier page results; only new or changed pages are extracted")
+    run_parser.add_argument("--restaurant-id", help="restaurant the inputs belong to (needed with --store, "
+                                                              "and for MENU_HASH_INDEX lookups)")
+    run_parser.set_defaults(handler=run)
+
+    batch_parser = commands.add_parser("batch", help="build the menus of every restaurant in a manifest")
+    batch.add_arguments(batch_parser)
+    batch_parser.set_defaults(handler=lambda args: 1 if batch.main(args) else 0)
+
+    job_parser = commands.add_parser("job", help="build the menus of a manifest through offline batch jobs (resumable)")
+    batch_jobs.add_arguments(job_parser)
+    job_parser.set_defaults(handler=lambda args: 1 if batch_jobs.main(args) else 0)
+
+    flatten_parser = commands.add_parser("flatten", help="post-process saved model outputs into one flat dataset")
+    flatten_parser.add_argument("inputs", nargs="+", help="JSON files of model outputs (e.g. written by batch)")
+    flatten_parser.add_argument("-o", "--output", required=True, help=".csv, .parquet or .arrow file")
+    flatten_parser.set_defaults(handler=flatten)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+import base64
+import hashlib
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from io import BytesIO
+
+from metrics import metrics
+
+
+HASH_SIZE = 16
+
+
+def image_hash(image, hash_size=HASH_SIZE):
+    """Median hash: hash_size**2 bits marking the darker-than-median cells of the cropped, contrast-stretched page."""
+    from PIL import Image, ImageChops, ImageOps
+
+    gray = ImageOps.autocontrast(image.convert("L"))
+    bbox = ImageChops.invert(gray).getbbox()  # crop the blank margins so scans and screenshots line up
+    if bbox:
+        gray = gray.crop(bbox)
+    pixels = list(gray.resize((hash_size, hash_size), Image.BOX, reducing_gap=2.0).getdata())
+    median = statistics.median(pixels)
+    value = 0
+    for pixel in pixels:
+        value = (value << 1) | (pixel < median)
+    return value
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def entry_hash(entry):
+    """Perceptual hash of a base64 image entry."""
+    from PIL import Image
+
+    return image_hash(Image.open(BytesIO(base64.b64decode(entry["image"]))))
+
+
+def content_digest(data):
+    """Exact digest of file bytes or an encoded page."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def entry_digest(entry):
+    """Exact digest of a rendered PDF page entry (its image, or its text without the first line)."""
+    if "image" in entry:
+        return content_digest(entry["image"])
+    return content_digest(entry.get("text", "").split("\n", 1)[-1])
+
+
+def text_digest(text):
+    # the first line of a text-layer entry names the page, which differs between copies of the same page
+    body = text.split("\n", 1)[-1]
+    return hashlib.sha1(" ".join(body.split()).encode("utf-8")).hexdigest()
+
+
+class ImageDeduplicator:
+    """Drops near-duplicate images and pages within a request.
+
+    Photos (after rotation correction) and rendered PDF pages are compared by their 256-bit median
+    hash, and anything within max_distance bits of an earlier input is dropped, e.g. the same photo
+    uploaded twice, or a screenshot of a page that also came as PDF. Text pages are compared by their text.
+    Rescaled copies differ by a few bits, re-encoded ones by up to 20, different pages by 40 or more;
+    but a page with the same layout and other prices (a lunch and a dinner sheet) can be as close as
+    a copy, and would be dropped with its items. So it is opt-in (MENU_DEDUP), with a tight default.
+    """
+
+    def __init__(self, max_distance=8):
+        self.max_distance = max_distance
+
+    def dedupe(self, inputs):
+        """Filters a list of PIL images and lists of PDF page entries.
+
+        Returns the filtered inputs and, for each one, the hash of the photo (None for PDF lists).
+        """
+        seen_images = []
+        seen_texts = set()
+
+        def is_duplicate(value):
+            if any(hamming(value, seen) <= self.max_distance for seen in seen_images):
+                return True
+            seen_images.append(value)
+            return False
+
+        kept = []
+        hashes = []
+        dropped = 0
+        for item in inputs:
+            if not isinstance(item, list):
+                value = image_hash(item)
+                if is_duplicate(value):
+                    dropped += 1
+                    continue
+                kept.append(item)
+                hashes.append(value)
+                continue
+
+            entries = []
+            skip_attached = False
+            for entry in item:
+                if entry.get("attached"):
+                    if not skip_attached:
+                        entries.append(entry)
+                    continue
+                if "text" in entry:
+                    digest = text_digest(entry["text"])
+                    skip_attached = digest in seen_texts
+                    seen_texts.add(digest)
+                else:
+                    value = entry_hash(entry)
+                    skip_attached = is_duplicate(value)
+                if skip_attached:
+                    dropped += 1
+                else:
+                    entries.append(entry)
+            kept.append(entries)
+            hashes.append(None)
+
+        metrics.count("menu_dedup_dropped_total", dropped)
+        return kept, hashes
+
+
+def single_image_digest(entries):
+    """Returns the content digest of a shard made of exactly one image, or None."""
+    if len(entries) == 1 and "image" in entries[0] and "digest" in entries[0]:
+        return entries[0]["digest"]
+    return None
+
+
+class HashIndex:
+    """Persistent index of (restaurant, image content digest) -> model response, so a known image is not extracted again.
+
+    Only an image with the exact same content (the digest of its file bytes, or of the rendered PDF
+    page) gets the stored response, and only responses produced with the current prompts
+    (prompt_fingerprint). Perceptual hashes are not used here: a repriced page hashes like the old one.
+    """
+
+    def __init__(self, path, prompt_fingerprint=""):
+        self.prompt_fingerprint = prompt_fingerprint
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS image_responses (restaurant_id TEXT NOT NULL, digest TEXT NOT NULL, "
+            "prompt_fingerprint TEXT NOT NULL, response TEXT NOT NULL, created_at REAL, "
+            "PRIMARY KEY (restaurant_id, digest, prompt_fingerprint))"
+        )
+        self.db.commit()
+
+    def lookup(self, restaurant_id, digest):
+        """Returns the response stored for this exact image of the restaurant, or None."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT response FROM image_responses WHERE restaurant_id = ? AND digest = ? AND prompt_fingerprint = ?",
+                (restaurant_id, digest, self.prompt_fingerprint),
+            ).fetchone()
+        response = row[0] if row else None
+        metrics.count("menu_cache_requests_total", cache="image_hash", result="miss" if response is None else "hit")
+        return response
+
+    def add(self, restaurant_id, digest, response):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO image_responses (restaurant_id, digest, prompt_fingerprint, response, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (restaurant_id, digest, self.prompt_fingerprint, response, time.time()),
+            )
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"}
+
+
+def sniff_file_type(content_type, head):
+    """Determines the file type from the Content-Type header, falling back to the leading bytes."""
+    if "application/pdf" in content_type:
+        return "pdf"
+    if "image" in content_type:
+        return "image"
+    if head.startswith(b"%PDF"):
+        return "pdf"
+    if head.startswith((b"\x89PNG", b"\xff\xd8\xff", b"GIF8", b"BM", b"II*\x00", b"MM\x00*")) or head[8:12] == b"WEBP":
+        return "image"
+    return "unknown"
+
+
+class UrlFetcher:
+    """Downloads menu files over a pooled keep-alive session.
+
+    Requests get a connect/read timeout, retries with exponential backoff on connection errors and
+    429/5xx responses, and a cap on the body size. Bodies are streamed in chunks. When a cache
+    directory is given they are streamed straight to disk along with their ETag/Last-Modified
+    validators, so later fetches of an unchanged menu are answered by a 304 without re-downloading.
+    Other URLs are rejected, unless allow_local_files is set (for a user's own command line, never for
+    URLs of a manifest): then they are read as local file paths (or file:// URLs).
+    """
+
+    def __init__(self, cache_dir=None, timeout=(5, 30), max_retries=3, backoff_factor=0.5, max_bytes=50 * 1024 * 1024,
+                 max_workers=8, pool_size=32, chunk_size=64 * 1024, headers=None, allow_local_files=False):
+        self.cache_dir = cache_dir
+        self.allow_local_files = allow_local_files
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+
+        retry = Retry(total=max_retries, backoff_factor=backoff_factor, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset(["GET"]), respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers.update(headers or DEFAULT_HEADERS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def cache_paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.cache_dir, key[:2], key)
+        return base + ".json", base + ".body"
+
+    def load_cached(self, url):
+        """Returns (metadata, body path) of a cached download, or (None, None)."""
+        if not self.cache_dir:
+            return None, None
+        meta_path, body_path = self.cache_paths(url)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None, None
+        if not os.path.exists(body_path):
+            return None, None
+        return meta, body_path
+
+    def store_cached(self, url, response, tmp_path):
+        meta_path, body_path = self.cache_paths(url)
+        meta = {
+            "url": url,
+            "content_type": response.headers.get("Content-Type", ""),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        os.replace(tmp_path, body_path)
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+        return body_path
+
+    def read_body(self, response, sink):
+        """Streams the response body into sink chunk by chunk, enforcing max_bytes."""
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > self.max_bytes:
+            raise ValueError(f"Content-Length {length} exceeds the limit of {self.max_bytes} bytes")
+
+        size = 0
+        for chunk in response.iter_content(chunk_size=self.chunk_size):
+            size += len(chunk)
+            if size > self.max_bytes:
+                raise ValueError(f"Body exceeds the limit of {self.max_bytes} bytes")
+            sink.write(chunk)
+        return size
+
+    def fetch(self, url):
+        """Fetches the content of a URL and determines its file type."""
+        with metrics.span("fetch"):
+            file_type, content = self._fetch(url)
+        metrics.count("menu_fetch_total", file_type=file_type)
+        if content is not None:
+            metrics.count("menu_fetch_bytes_total", len(content), file_type=file_type)
+        return file_type, content
+
+    def read_file(self, path):
+        """Reads a local menu file and determines its file type from its leading bytes."""
+        try:
+            size = os.path.getsize(path)
+            if size > self.max_bytes:
+                raise ValueError(f"File size {size} exceeds the limit of {self.max_bytes} bytes")
+            with open(path, "rb") as f:
+                content = f.read()
+        except (OSError, ValueError) as e:
+            logger.warning("Error reading %s: %s", path, e)
+            return "unknown", None
+
+        file_type = sniff_file_type("", content[:16])
+        if file_type == "unknown":
+            return "unknown", None
+        return file_type, content
+
+    def _fetch(self, url):
+        if not url.startswith(("http://", "https://")):
+            if not self.allow_local_files:
+                logger.warning("Skipping %s: only http(s) URLs are fetched", url)
+                return "unknown", None
+            return self.read_file(url[len("file://"):] if url.startswith("file://") else url)
+
+        meta, cached_body = self.load_cached(url)
+        headers = {}
+        if meta:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            with self.session.get(url, headers=headers, allow_redirects=True, stream=True, timeout=self.timeout) as response:
+                retries = getattr(response.raw, "retries", None)
+                if retries is not None and retries.history:
+                    metrics.count("menu_fetch_retries_total", len(retries.history))
+                if response.status_code == 304 and meta:
+                    metrics.count("menu_fetch_not_modified_total")
+                    content_type = meta.get("content_type", "").lower()
+                    with open(cached_body, "rb") as f:
+                        content = f.read()
+                elif response.status_code != 200:
+                    logger.warning("Error fetching %s: status code %d", url, response.status_code)
+                    return "unknown", None
+                elif self.cache_dir:
+                    content_type = response.headers.get("Content-Type", "").lower()
+                    body_dir = os.path.dirname(self.cache_paths(url)[1])
+                    os.makedirs(body_dir, exist_ok=True)
+                    fd, tmp_path = tempfile.mkstemp(dir=body_dir, suffix=".part")
+                    try:
+                        with os.fdopen(fd, "wb") as f:
+                            self.read_body(response, f)
+                        body_path = self.store_cached(url, response, tmp_path)
+                    except BaseException:
+                        os.unlink(tmp_path)
+                        raise
+                    with open(body_path, "rb") as f:
+                        content = f.read()
+                else:
+                    content_type = response.headers.get("Content-Type", "").lower()
+                    buffer = BytesIO()
+                    self.read_body(response, buffer)
+                    content = buffer.getvalue()
+
+        except (requests.RequestException, ValueError) as e:
+            logger.warning("Error fetching %s: %s", url, e)
+            return "unknown", None
+
+        file_type = sniff_file_type(content_type, content[:16])
+        if file_type == "unknown":
+            return "unknown", None
+        return file_type, content
+
+    def executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="fetch")
+            return self._executor
+
+    def fetch_all(self, urls):
+        """Fetches all URLs in parallel and returns their (file_type, content) tuples in input order."""
+        if len(urls) <= 1:
+            return [self.fetch(url) for url in urls]
+        return list(self.executor().map(self.fetch, urls))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        self.session.close()
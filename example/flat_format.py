@@ -0,0 +1,142 @@
+import csv
+import os
+import threading
+
+from metrics import metrics
+from postprocess import postprocess_menu
+
+
+# columns of the flat dataset: the restaurant, the row type, the position of the row in its menu
+# (sort_ids of the category, item, extra and option it belongs to) and the flat menu format columns
+FLAT_COLUMNS = [
+    ("restaurant_id", "string"),
+    ("type", "string"),
+    ("category_sort_id", "int32"),
+    ("item_sort_id", "int32"),
+    ("extra_sort_id", "int32"),
+    ("option_sort_id", "int32"),
+    ("name", "string"),
+    ("description", "string"),
+    ("price", "int64"),
+    ("num_min_options", "int32"),
+    ("num_max_options", "int32"),
+    ("num_free_options", "int32"),
+]
+FORMATS = {".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow", ".csv": "csv"}
+
+
+class FlatColumns:
+    """Column buffers the menu rows are appended to, one list per column of FLAT_COLUMNS."""
+
+    def __init__(self):
+        self.columns = {name: [] for name, _ in FLAT_COLUMNS}
+        self.appenders = [values.append for values in self.columns.values()]
+
+    def __len__(self):
+        return len(self.columns["type"])
+
+    def clear(self):
+        self.truncate(0)
+
+    def truncate(self, length):
+        """Drops the rows from position length on."""
+        for values in self.columns.values():
+            del values[length:]
+
+    def append_clean(self, *row):
+        """Appends a row of already validated values, in the order of FLAT_COLUMNS."""
+        for append, value in zip(self.appenders, row):
+            append(value)
+
+
+def arrow_schema():
+    import pyarrow as pa
+
+    return pa.schema([(name, getattr(pa, dtype)()) for name, dtype in FLAT_COLUMNS])
+
+
+class FlatMenuWriter:
+    """Streams flattened menus of many restaurants into one Parquet, Arrow IPC or CSV file.
+
+    Rows are appended to typed column buffers and written out as a row group whenever row_group_size
+    rows have accumulated, so memory stays flat however many menus go through. The format follows
+    the file extension unless given. Parquet and Arrow need pyarrow. Safe to share between threads.
+    """
+
+    def __init__(self, path, format=None, row_group_size=50_000):
+        self.path = path
+        self.format = format or FORMATS.get(os.path.splitext(path)[1].lower())
+        if self.format not in FORMATS.values():
+            raise ValueError(f"Unsupported flat menu format: {path}")
+        self.row_group_size = row_group_size
+        self.buffer = FlatColumns()
+        self.lock = threading.Lock()
+        self.rows = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if self.format == "csv":
+            self.file = open(path, "w", newline="", encoding="utf-8")
+            self.csv = csv.writer(self.file)
+            self.csv.writerow([name for name, _ in FLAT_COLUMNS])
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            self.schema = arrow_schema()
+            if self.format == "parquet":
+                self.writer = pq.ParquetWriter(path, self.schema)
+            else:
+                self.writer = pa.ipc.new_file(path, self.schema)
+
+    def write_menu(self, menu_json, restaurant_id=""):
+        """Post-processes one menu_output (see postprocess.postprocess_menu) and appends its rows."""
+        flat = FlatColumns()
+        postprocess_menu(menu_json, flat, restaurant_id)
+        self.write_columns(flat)
+
+    def write_columns(self, flat):
+        """Appends rows that were already flattened into a FlatColumns buffer."""
+        with self.lock:
+            for name, values in flat.columns.items():
+                self.buffer.columns[name].extend(values)
+            self.rows += len(flat)
+            self._flush_full()
+
+    def _flush_full(self):
+        if len(self.buffer) >= self.row_group_size:
+            self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not len(self.buffer):
+            return
+        with metrics.span("flat_write", format=self.format):
+            columns = self.buffer.columns
+            if self.format == "csv":
+                self.csv.writerows(["" if value is None else value for value in row] for row in zip(*columns.values()))
+                self.file.flush()
+            else:
+                import pyarrow as pa
+
+                self.writer.write_batch(pa.RecordBatch.from_pydict(columns, schema=self.schema))
+        metrics.count("menu_flat_rows_total", len(self.buffer), format=self.format)
+        self.buffer.clear()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            if self.format == "csv":
+                self.file.close()
+            else:
+                self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
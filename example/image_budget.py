@@ -0,0 +1,138 @@
+import math
+
+
+
+# vision tiling rules of the gpt-4o family (high detail)
+MAX_SIDE = 2048
+SHORT_SIDE = 768
+TILE_SIZE = 512
+BASE_TOKENS = 85
+TILE_TOKENS = 170
+
+
+def model_view_size(width, height):
+    """Returns the size an image is scaled to by the model before it is cut into tiles."""
+    scale = min(1.0, MAX_SIDE / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, SHORT_SIDE / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def estimate_image_tokens(width, height, detail="high"):
+    """Estimates the vision tokens an image of the given size costs."""
+    if detail == "low":
+        return BASE_TOKENS
+    width, height = model_view_size(width, height)
+    return BASE_TOKENS + TILE_TOKENS * math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+
+
+def crop_margins(image, tolerance=24, padding=8):
+    """Crops blank margins, taking the background colour from the top left corner."""
+    from PIL import Image, ImageChops
+
+    gray = image.convert("L")
+    background = Image.new("L", gray.size, gray.getpixel((0, 0)))
+    mask = ImageChops.difference(gray, background).point(lambda p: 255 if p > tolerance else 0)
+    bbox = mask.getbbox()
+    if bbox is None:
+        return image
+    left, top, right, bottom = bbox
+    bbox = (max(left - padding, 0), max(top - padding, 0),
+            min(right + padding, image.width), min(bottom + padding, image.height))
+    return image.crop(bbox) if bbox != (0, 0, image.width, image.height) else image
+
+
+def split_long_image(image, max_aspect=2.5, overlap=0.05):
+    """Splits very tall (or wide) images into overlapping tiles with an aspect ratio of at most max_aspect.
+
+    The model shrinks an image until its long side fits 2048px, which makes the text of a long menu
+    strip illegible; tiles keep their resolution instead.
+    """
+    width, height = image.size
+    vertical = height >= width
+    long_side, short_side = (height, width) if vertical else (width, height)
+    if long_side <= max_aspect * short_side:
+        return [image]
+
+    count = math.ceil(long_side / (max_aspect * short_side))
+    step = long_side / count
+    margin = int(step * overlap)
+    tiles = []
+    for i in range(count):
+        start = max(int(i * step) - margin, 0)
+        end = min(int((i + 1) * step) + margin, long_side)
+        box = (0, start, width, end) if vertical else (start, 0, end, height)
+        tiles.append(image.crop(box))
+    return tiles
+
+
+def short_side_size(size, short_side):
+    """Returns size scaled down so that its short side is at most short_side."""
+    width, height = size
+    scale = short_side / min(width, height)
+    if scale >= 1:
+        return size
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def resize_short_side(image, short_side):
+    """Downscales an image so its short side is at most short_side."""
+    from PIL import Image
+
+    size = short_side_size(image.size, short_side)
+    return image.resize(size, Image.LANCZOS, reducing_gap=2.0) if size != image.size else image
+
+
+class ImageBudget:
+    """Shrinks menu photos to what the model can use, within a per-request vision token budget.
+
+    Each image has its blank margins cropped and is split into tiles if it is very long. It is then
+    downscaled to the size the model would scale it to anyway, since pixels beyond that only cost
+    upload time. If a request still needs more than max_request_tokens, all images are downscaled
+    further, but never below min_short_side, which keeps printed menu text legible.
+    """
+
+    def __init__(self, max_request_tokens=8000, min_short_side=512, max_aspect=2.5, crop=True):
+        self.max_request_tokens = max_request_tokens
+        self.min_short_side = min_short_side
+        self.max_aspect = max_aspect
+        self.crop = crop
+
+    def prepare_image(self, image):
+        """Returns the tiles of one image, each downscaled to the size the model actually sees."""
+        from PIL import Image
+
+        if self.crop:
+            image = crop_margins(image)
+        tiles = []
+        for tile in split_long_image(image, self.max_aspect):
+            size = model_view_size(*tile.size)
+            if size != tile.size:
+                tile = tile.resize(size, Image.LANCZOS, reducing_gap=2.0)
+            tiles.append(tile)
+        return tiles
+
+    def fit(self, images, reserved_tokens=0):
+        """Prepares a request's images and enforces the token budget across all of them.
+
+        reserved_tokens accounts for images in the request that are not resized here (e.g. PDF pages).
+        Returns one list of tiles per input image.
+        """
+        prepared = [self.prepare_image(image) for image in images]
+        tiles = [tile for image_tiles in prepared for tile in image_tiles]
+        budget = self.max_request_tokens - reserved_tokens
+
+        short_side = SHORT_SIDE
+        while short_side > self.min_short_side:
+            total = sum(estimate_image_tokens(*short_side_size(tile.size, short_side)) for tile in tiles)
+            if total <= budget:
+                break
+            short_side = max(short_side - TILE_SIZE // 4, self.min_short_side)
+
+        if short_side == SHORT_SIDE:
+            return prepared
+        return [[resize_short_side(tile, short_side) for tile in image_tiles] for image_tiles in prepared]
+
+    def request_tokens(self, entries):
+        """Estimates the vision tokens of a list of image entries that carry their size."""
+        return sum(estimate_image_tokens(*entry["size"]) for entry in entries if "size" in entry)
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+from postprocess import postprocess_menu
+from sharding import normalize_name, shard_entries, merge_shard_outputs, parse_shard_responses
+
+
+logger = logging.getLogger(__name__)
+
+
+def page_digest(entries):
+    """Hashes the content of one page (its image and/or text entries), ignoring bookkeeping keys.
+
+    Entries carry the digest of their source content (see menuBuilder.preprocess_inputs), which does
+    not change when the image budget sends the page at another size; it is used when present.
+    """
+    h = hashlib.sha256()
+    for entry in entries:
+        if "digest" in entry:
+            h.update(b"digest\0")
+            h.update(entry["digest"].encode("ascii"))
+        elif "image" in entry:
+            h.update(b"image\0")
+            h.update(entry["image"].encode("ascii"))
+        else:
+            # the first line of a text-layer entry names the page, which changes when pages move
+            h.update(b"text\0")
+            h.update(entry.get("text", "").split("\n", 1)[-1].encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def menu_items(menu_output):
+    """Maps (category, item) names of a clean menu_output to their prices."""
+    items = {}
+    for category in (menu_output or {}).get("categories", []):
+        for item in category["items"]:
+            items[(normalize_name(category["name"]), normalize_name(item["name"]))] = (category["name"], item["name"], item["price"])
+    return items
+
+
+def menu_diff(old_output, new_output):
+    """Lists the items added, removed and repriced between two menu_outputs (compared after post-processing)."""
+    old = menu_items(postprocess_menu(old_output or {}))
+    new = menu_items(postprocess_menu(new_output or {}))
+    diff = {"added": [], "removed": [], "repriced": []}
+    for key, (category, name, price) in new.items():
+        if key not in old:
+            diff["added"].append({"category": category, "name": name, "price": price})
+        elif old[key][2] != price:
+            diff["repriced"].append({"category": category, "name": name, "old_price": old[key][2], "price": price})
+    for key, (category, name, price) in old.items():
+        if key not in new:
+            diff["removed"].append({"category": category, "name": name, "price": price})
+    return diff
+
+
+class ExtractionStore:
+    """SQLite store of earlier extractions: the model response of every page, keyed by restaurant and page
+    content hash, and the last merged output of every restaurant.
+
+    Everything is keyed by a prompt fingerprint too, so results of older prompts are never reused.
+    """
+
+    def __init__(self, path, prompt_fingerprint=""):
+        self.prompt_fingerprint = prompt_fingerprint
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS pages (restaurant_id TEXT NOT NULL, page_hash TEXT NOT NULL, "
+            "prompt_fingerprint TEXT NOT NULL, response TEXT NOT NULL, updated_at REAL, "
+            "PRIMARY KEY (restaurant_id, page_hash, prompt_fingerprint))"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS menus (restaurant_id TEXT NOT NULL, prompt_fingerprint TEXT NOT NULL, "
+            "page_hashes TEXT NOT NULL, output TEXT NOT NULL, updated_at REAL, "
+            "PRIMARY KEY (restaurant_id, prompt_fingerprint))"
+        )
+        self.db.commit()
+
+    def page_responses(self, restaurant_id, page_hashes):
+        """Returns {page hash: response} for the pages of a restaurant that were extracted before."""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT page_hash, response FROM pages WHERE restaurant_id = ? AND prompt_fingerprint = ?",
+                (restaurant_id, self.prompt_fingerprint),
+            ).fetchall()
+        wanted = set(page_hashes)
+        return {page_hash: response for page_hash, response in rows if page_hash in wanted}
+
+    def previous_output(self, restaurant_id):
+        """Returns the last merged output (dict) of a restaurant, or None."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT output FROM menus WHERE restaurant_id = ? AND prompt_fingerprint = ?",
+                (restaurant_id, self.prompt_fingerprint),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, restaurant_id, page_hashes, new_responses, output):
+        """Stores the responses of newly extracted pages and the merged output, and forgets pages that are gone."""
+        now = time.time()
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO pages (restaurant_id, page_hash, prompt_fingerprint, response, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(restaurant_id, page_hash, self.prompt_fingerprint, response, now)
+                 for page_hash, response in new_responses.items()],
+            )
+            placeholders = ", ".join("?" * len(page_hashes))
+            self.db.execute(
+                f"DELETE FROM pages WHERE restaurant_id = ? AND prompt_fingerprint = ? AND page_hash NOT IN ({placeholders})",
+                [restaurant_id, self.prompt_fingerprint] + list(page_hashes),
+            )
+            self.db.execute(
+                "INSERT OR REPLACE INTO menus (restaurant_id, prompt_fingerprint, page_hashes, output, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (restaurant_id, self.prompt_fingerprint, json.dumps(list(page_hashes)), json.dumps(output), now),
+            )
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+class IncrementalExtractor:
+    """Re-extracts only the pages of a resubmitted menu that are new or changed.
+
+    The preprocessed inputs are split into pages (see shard_entries) and every page is hashed. Pages
+    whose hash is in the store reuse their stored response; the others go to the model, one call per
+    page. All page responses are then merged in page order like sharded outputs, so an unchanged menu
+    comes out identical, sort_ids included. Returns the merged output and a diff against the last one.
+    Triage is not applied, and changed pages skip the hash index, since the store already knows
+    every page seen before.
+    """
+
+    def __init__(self, builder, store):
+        self.builder = builder
+        self.store = store
+
+    def extract(self, restaurant_id, base64_images, priority=None):
+        """Returns (output JSON string, diff) for the preprocessed inputs of one restaurant."""
+        pages = shard_entries(base64_images, 1)
+        page_hashes = [page_digest(page) for page in pages]
+        known = self.store.page_responses(restaurant_id, page_hashes)
+        changed = {}
+        for page, page_hash in zip(pages, page_hashes):
+            if page_hash not in known and page_hash not in changed:
+                changed[page_hash] = page
+
+        metrics.count("menu_incremental_pages_total", len(pages) - len(changed), result="reused")
+        metrics.count("menu_incremental_pages_total", len(changed), result="extracted")
+        logger.info("restaurant %s: %d of %d pages changed", restaurant_id, len(changed), len(pages))
+
+        new_responses = {}
+        if changed:
+            with ThreadPoolExecutor(max_workers=min(len(changed), self.builder.max_shard_concurrency)) as pool:
+                responses = pool.map(lambda page: self.builder.extract_shard(page, priority, use_hash_index=False), changed.values())
+                for page_hash, response in zip(changed, responses):
+                    new_responses[page_hash] = response
+
+        responses = {**known, **new_responses}
+        output = merge_shard_outputs(parse_shard_responses([responses[page_hash] for page_hash in page_hashes]))
+
+        previous = self.store.previous_output(restaurant_id)
+        diff = menu_diff((previous or {}).get("menu_output"), output.get("menu_output"))
+        valid_responses = {}
+        for page_hash, response in new_responses.items():
+            try:
+                json.loads(response)
+            except (TypeError, ValueError):
+                continue  # extracted again next time
+            valid_responses[page_hash] = response
+        self.store.save(restaurant_id, page_hashes, valid_responses, output)
+        return json.dumps(output), diff
@@ -0,0 +1,180 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+COUNT_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, metrics, stage, labels):
+        self.metrics = metrics
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        seconds = time.perf_counter() - self.start
+        self.metrics.observe("menu_stage_seconds", seconds, stage=self.stage, **self.labels)
+        if exc_type is not None:
+            self.metrics.count("menu_stage_errors_total", stage=self.stage, **self.labels)
+        if self.metrics.log_events:
+            logger.info(json.dumps({"event": "span", "stage": self.stage, "seconds": round(seconds, 6),
+                                    "error": exc_type.__name__ if exc_type else None, **self.labels}))
+        return False
+
+
+class Metrics:
+    """Pipeline instrumentation: per-stage spans, counters and histograms.
+
+    Spans record their duration in the menu_stage_seconds histogram, labelled by stage. Everything can
+    be exported in the Prometheus text format (to a file or over HTTP), and with log_events each span
+    is also written as a JSON log line. When disabled, span() returns a shared no-op context manager
+    and count()/observe() return immediately.
+    """
+
+    def __init__(self, enabled=False, log_events=False, reservoir_size=1024):
+        self.enabled = enabled
+        self.log_events = log_events
+        self.reservoir_size = reservoir_size
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def span(self, stage, **labels):
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, stage, labels)
+
+    def count(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        buckets = SECONDS_BUCKETS if name.endswith("_seconds") else COUNT_BUCKETS
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0,
+                                                    "count": 0, "samples": deque(maxlen=self.reservoir_size)}
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+            histogram["samples"].append(value)
+
+    def quantile(self, name, q, **labels):
+        """Returns the q-quantile of the most recent observations of a histogram series, or None."""
+        with self.lock:
+            histogram = self.histograms.get((name, tuple(sorted(labels.items()))))
+            samples = sorted(histogram["samples"]) if histogram else []
+        if not samples:
+            return None
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+    def snapshot(self):
+        """Returns counters and histogram summaries (count, sum, p50, p95) as a JSON-serializable dict."""
+        with self.lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in self.counters.items()]
+            histograms = [(name, labels, h["count"], h["sum"], sorted(h["samples"]))
+                          for (name, labels), h in self.histograms.items()]
+        summaries = []
+        for name, labels, count, total, samples in histograms:
+            summaries.append({"name": name, "labels": dict(labels), "count": count, "sum": total,
+                              "p50": samples[int(0.5 * (len(samples) - 1))],
+                              "p95": samples[int(0.95 * (len(samples) - 1))]})
+        return {"counters": counters, "histograms": summaries}
+
+    def log_snapshot(self):
+        logger.info(json.dumps({"event": "metrics", **self.snapshot()}))
+
+    def to_prometheus(self):
+        """Renders all series in the Prometheus text exposition format."""
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs) + "}"
+
+        lines = []
+        with self.lock:
+            seen = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} counter")
+                    seen.add(name)
+                lines.append(f"{name}{fmt(labels)} {value}")
+            for (name, labels), h in sorted(self.histograms.items(), key=lambda kv: kv[0]):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} histogram")
+                    seen.add(name)
+                for bound, count in zip(h["buckets"], h["counts"]):
+                    lines.append(f"{name}_bucket{fmt(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {h['count']}")
+                lines.append(f"{name}_sum{fmt(labels)} {h['sum']}")
+                lines.append(f"{name}_count{fmt(labels)} {h['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Writes the metrics to a file (e.g. for the node exporter textfile collector)."""
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(path + ".tmp", path)
+
+    def serve_prometheus(self, port, host="0.0.0.0"):
+        """Serves the metrics at http://host:port/metrics from a daemon thread; returns the server."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+# shared registry; enable with MENU_METRICS=1 (MENU_METRICS_LOG=1 also logs every span as JSON)
+metrics = Metrics(enabled=os.getenv("MENU_METRICS") == "1", log_events=os.getenv("MENU_METRICS_LOG") == "1")
@@ -1,20 +1,31 @@
 import json
-import requests
-import urllib 
-from PIL import Image
 from io import BytesIO
 import base64
-import pytesseract
-import cv2
-import requests
-import pymupdf
-import openai
-from openai import OpenAI
 import os
-import pandas as pd 
+import threading
+import time
+# heavy dependencies (openai, pandas, pymupdf, requests, pytesseract) are imported on first use
+from image_budget import ImageBudget
+from orientation import OrientationDetector
+from sharding import shard_entries, merge_shard_outputs, parse_shard_responses
+from concurrent.futures import ThreadPoolExecutor
+from response_cache import ResponseCache, prompt_fingerprint, response_cache_key
+from streaming import IncrementalMenuParser
+from metrics import metrics
+from scheduler import RequestScheduler, INTERACTIVE
+from triage import MenuTriage
+from dedup import ImageDeduplicator, HashIndex, content_digest, entry_digest, single_image_digest
+from prompt_prefix import api_messages, prefix_messages
+from flat_format import FlatColumns
+from postprocess import postprocess_menu
+from incremental import ExtractionStore
+import logging
+import csv
 
 openai_api_key = os.getenv("YOU_OPENAI_API_KEY")
 
+logger = logging.getLogger(__name__)
+
 
 extraction_examples = """
 {"is_valid_menu": "yes",
@@ -273,216 +284,393 @@ If the image does not contain a valid restaurant menu, menu_JSON should be an em
 
 
 class ChatCompletionAgent:
-    def __init__(self, model_name, openai_api_key, temperature, response_format):
+    def __init__(self, model_name, openai_api_key, temperature, response_format, cache=None, base_url=None,
+                 scheduler=None):
         self.model_name = model_name
         self.temperature = temperature
         self.response_format = response_format
+        self.cache = cache
+        self.scheduler = scheduler
+        from openai import OpenAI
+
         self.client = OpenAI(
             api_key = openai_api_key, 
-            organization = "org-HvVpqVsX21frElw6ih05m7aS"
+            organization = "org-HvVpqVsX21frElw6ih05m7aS",
+            base_url = base_url,
+            max_retries = 0 if scheduler is not None else 2  # the scheduler does its own retries
         )
 
-    def get_response(self, messages):
+    def create_completion(self, params, priority):
+        """Sends a chat completion request, through the scheduler if there is one; returns (completion, token estimate)."""
+        request = dict(params, messages=api_messages(params["messages"]))
+
+        def call():
+            return self.client.chat.completions.create(**request)
+
+        if self.scheduler is None:
+            return call(), None
+        return self.scheduler.run(call, params["messages"], INTERACTIVE if priority is None else priority)
+
+    def record_usage(self, usage, estimated_tokens=None):
+        if usage is not None:
+            metrics.count("menu_prompt_tokens_total", usage.prompt_tokens, model=self.model_name)
+            metrics.count("menu_completion_tokens_total", usage.completion_tokens, model=self.model_name)
+            details = getattr(usage, "prompt_tokens_details", None)
+            cached_tokens = getattr(details, "cached_tokens", None) or 0
+            metrics.count("menu_prompt_cached_tokens_total", cached_tokens, model=self.model_name)
+            logger.debug("prompt tokens: %d cached, %d uncached", cached_tokens, usage.prompt_tokens - cached_tokens)
+            if estimated_tokens is not None:
+                self.scheduler.settle(estimated_tokens, usage.total_tokens)
+
+    def stream_response(self, messages, priority=None):
+        """Yields the response text in chunks as the model produces it. Closing the generator cancels the request."""
+        cache_key = None
+        if self.cache is not None:
+            cache_key = response_cache_key(self.model_name, self.temperature, self.response_format, messages)
+            cached = self.cache.get(cache_key)
+            metrics.count("menu_cache_requests_total", cache="response", result="miss" if cached is None else "hit")
+            if cached is not None:
+                yield cached
+                return
+
+        params = {
+            "model": self.model_name,
+            "messages": messages,
+            "temperature": self.temperature,
+            "response_format": self.response_format,
+            "stream": True,
+            "stream_options": {"include_usage": True}
+        }
+        start = time.perf_counter()
+        stream, estimated_tokens = self.create_completion(params, priority)
+        chunks = []
+        try:
+            for chunk in stream:
+                if chunk.usage is not None:
+                    self.record_usage(chunk.usage, estimated_tokens)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if not chunks:
+                        metrics.observe("menu_stage_seconds", time.perf_counter() - start, stage="llm_first_token", model=self.model_name)
+                    chunks.append(chunk.choices[0].delta.content)
+                    yield chunks[-1]
+        finally:
+            stream.close()
+            metrics.observe("menu_stage_seconds", time.perf_counter() - start, stage="llm_stream", model=self.model_name)
+
+        if cache_key is not None and chunks:
+            self.cache.set(cache_key, "".join(chunks))
+
+    def get_response(self, messages, priority=None):
+        cache_key = None
+        if self.cache is not None:
+            cache_key = response_cache_key(self.model_name, self.temperature, self.response_format, messages)
+            cached = self.cache.get(cache_key)
+            metrics.count("menu_cache_requests_total", cache="response", result="miss" if cached is None else "hit")
+            if cached is not None:
+                return cached
+
         params = {
             "model": self.model_name,
             "messages": messages,
             "temperature": self.temperature,
             "response_format": self.response_format
         }    
-        completion = self.client.chat.completions.create(**params)
+        with metrics.span("llm", model=self.model_name):
+            completion, estimated_tokens = self.create_completion(params, priority)
+        self.record_usage(completion.usage, estimated_tokens)
         response = completion.choices[0].message.content
+
+        if cache_key is not None and response:
+            self.cache.set(cache_key, response)
             
         return response
 
 
+# photo formats the model accepts as they are
+PASSTHROUGH_MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+
 class menuBuilder:
-    def __init__(self, system_instruction_prompt, menu_extraction_prompt, extraction_examples, chat_agent):
+    def __init__(self, system_instruction_prompt, menu_extraction_prompt, extraction_examples, chat_agent, fetcher=None, pdf_renderer=None,
+                 image_budget=None, orientation_detector=None, sharded=False, pages_per_shard=1,
+                 max_shard_concurrency=8, triage=None, deduplicator=None, hash_index=None, jpeg_quality=90,
+                 process_workers=1):
         self.extraction_examples = extraction_examples
         self.system_instruction_prompt = system_instruction_prompt
         self.menu_extraction_prompt = menu_extraction_prompt  
         self.chat_agent = chat_agent
+        if fetcher is None:
+            from fetcher import UrlFetcher
+            fetcher = UrlFetcher()
+        if pdf_renderer is None:
+            from pdf_render import PdfRenderer
+            pdf_renderer = PdfRenderer(max_workers=process_workers)
+        self.fetcher = fetcher
+        self.pdf_renderer = pdf_renderer
+        self.image_budget = image_budget or ImageBudget()
+        self.orientation_detector = orientation_detector or OrientationDetector(max_workers=process_workers)
+        self.sharded = sharded
+        self.pages_per_shard = pages_per_shard
+        self.max_shard_concurrency = max_shard_concurrency
+        self.triage = triage
+        self.deduplicator = deduplicator
+        self.hash_index = hash_index
+        self.jpeg_quality = jpeg_quality
 
     
     def fetch_url_content(self, url):
         """Fetches the content of a URL and determines its file type."""
-        try:
-            headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"}
-            response = requests.get(url, headers=headers, allow_redirects=True)
-            if response.status_code != 200:
-                raise Exception(f"Failed to fetch URL: {url}, Status Code: {response.status_code}")
-
-            content_type = response.headers.get("Content-Type", "").lower()
-            
-            if "application/pdf" in content_type:
-                return "pdf", response.content
-            elif "image" in content_type:
-                return "image", response.content
-
-        except requests.RequestException as e:
-            print(f"Error fetching {url}: {e}")
-            return "unknown", None
+        return self.fetcher.fetch(url)
 
     def pdf_to_base64_images(self, pdf_content):
-        """Converts a PDF (bytes) into a list of base64-encoded images."""
-        base64_images = []
-        pdf_stream = BytesIO(pdf_content)
-        pdf_document = pymupdf.open(stream=pdf_stream, filetype="pdf")  # Open PDF in memory
-
-        for page_num in range(len(pdf_document)):
-            page = pdf_document[page_num]
-            pix = page.get_pixmap(matrix=pymupdf.Matrix(2, 2))  # High resolution (2x scale)
-            img = BytesIO(pix.tobytes("png"))  # Convert to PNG
-            base64_images.append({"image": base64.b64encode(img.getvalue()).decode("utf-8")})
-
-        return base64_images
+        """Converts a PDF (bytes) into base64-encoded images (or text entries for born-digital pages), yielded page by page."""
+        return self.pdf_renderer.render(pdf_content)
 
 
     def correct_image_rotation(self, image_bytes):
-        """Detects and corrects 90°, 180°, or 270° rotated images using pytesseract."""
-        # Convert bytes to PIL Image
-        img_pil = Image.open(BytesIO(image_bytes))
-        try:
-            img_cv = cv2.cvtColor(np.array(img_pil), cv2.COLOR_RGB2BGR)  # Convert to OpenCV format
-
-            # Use Tesseract to detect orientation
-            osd = pytesseract.image_to_osd(img_cv, output_type=pytesseract.Output.DICT)
-            angle = osd.get("rotate", 0)  # Get the detected rotation angle
-            orientation_conf = osd.get("orientation_conf", 0) # Get the confidence level
-
-            # Rotate the image by the detected angle (negative to correct it)
-            if (orientation_conf > 5) and (angle != 0):  # Only rotate if necessary
-                img_pil = img_pil.rotate(-angle, expand=True)  
-            return img_pil
-        except:
-            print('tesseract error')
-            return img_pil
+        """Detects and corrects 90°, 180°, or 270° rotated images (EXIF orientation, then pytesseract OSD)."""
+        image, _ = self.orientation_detector.correct(image_bytes)
+        return image
 
     def image_to_base64(self, image):
         """Converts a PIL image to base64."""
-        img_bytes = BytesIO()
-        image.save(img_bytes, format="PNG")
-        return base64.b64encode(img_bytes.getvalue()).decode("utf-8")
+        with metrics.span("image_encode"):
+            img_bytes = BytesIO()
+            image.save(img_bytes, format="PNG")
+            return base64.b64encode(img_bytes.getbuffer()).decode("ascii")
+
+    def encode_photo(self, image, original=None):
+        """Returns the base64 entry of a photo (tile).
+
+        A photo that was neither rotated nor cropped/resized (still the image decoded from the file)
+        is sent as its original file bytes when the model accepts the format; anything else is
+        encoded once as JPEG.
+        """
+        with metrics.span("image_encode"):
+            if original is not None and image.format in PASSTHROUGH_MIME_TYPES:
+                metrics.count("menu_image_encode_total", mode="passthrough")
+                return {"image": base64.b64encode(original).decode("ascii"), "mime": PASSTHROUGH_MIME_TYPES[image.format],
+                        "size": image.size}
+            metrics.count("menu_image_encode_total", mode="jpeg")
+            buffer = BytesIO()
+            image.convert("RGB").save(buffer, format="JPEG", quality=self.jpeg_quality)
+            return {"image": base64.b64encode(buffer.getbuffer()).decode("ascii"), "mime": "image/jpeg",
+                    "size": image.size}
       
 
-    def generate_gpt_messages(self, system_instruction_prompt, menu_extraction_prompt, extraction_examples, urls):
-        
-        base64_images = []
-
-        for url in urls:
-            file_type, content = self.fetch_url_content(url)
-
+    def fetch_inputs(self, urls):
+        """Fetches every URL in parallel and returns a list of (url, file_type, content) tuples."""
+        with metrics.span("fetch_all"):
+            fetched = self.fetcher.fetch_all(urls)
+        return [(url, file_type, content) for url, (file_type, content) in zip(urls, fetched)]
+
+    def preprocess_inputs(self, fetched):
+        """Converts fetched contents (rotation correction, PDF rendering) into base64 images.
+
+        Raises ValueError if none of the inputs could be fetched or read.
+        """
+        with metrics.span("preprocess"):
+            return self._preprocess_inputs(fetched)
+
+    def _preprocess_inputs(self, fetched):
+        # PDF pages are rendered within their own pixel budget; photos share what is left of the token budget
+        photos = iter(self.orientation_detector.correct_many([content for _, file_type, content in fetched if file_type == "image"]))
+        inputs = []
+        originals = {}  # id of an untouched (decoded as is) photo -> its file bytes
+        for url, file_type, content in fetched:
             if file_type == "image":
-                rotated_image = self.correct_image_rotation(content)  # Correct rotation
-                base64_images.append({"image": self.image_to_base64(rotated_image)})
+                image = next(photos)[0]  # Rotation corrected
+                originals[id(image)] = content
+                inputs.append(image)
             elif file_type == "pdf":
-                base64_images.extend(self.pdf_to_base64_images(content))  # Convert PDF to images
+                with metrics.span("pdf_render"):
+                    inputs.append(list(self.pdf_to_base64_images(content)))  # Convert PDF to images
+                metrics.observe("menu_pdf_pages", len(inputs[-1]))
             else:
-                print(f"Skipping unsupported file type for URL: {url}")
+                logger.warning("Skipping unsupported file type for URL: %s", url)
+
+        # drop near-duplicate photos and pages
+        if self.deduplicator is not None:
+            with metrics.span("dedup"):
+                inputs, _ = self.deduplicator.dedupe(inputs)
+
+        photos = [item for item in inputs if not isinstance(item, list)]
+        pdf_entries = [entry for item in inputs if isinstance(item, list) for entry in item]
+        with metrics.span("image_budget"):
+            fitted = self.image_budget.fit(photos, reserved_tokens=self.image_budget.request_tokens(pdf_entries))
+        del photos, pdf_entries
+
+        # each photo (its decoded image, tiles and file bytes) is released as soon as it is encoded;
+        # every entry carries the exact digest of its source content, whatever size it was sent at
+        base64_images = []
+        fitted.reverse()
+        for index in range(len(inputs)):
+            item, inputs[index] = inputs[index], None
+            if isinstance(item, list):
+                for entry in item:
+                    entry["digest"] = entry_digest(entry)
+                base64_images.extend(item)
+                continue
+            tiles = fitted.pop()
+            original = originals.pop(id(item))
+            digest = content_digest(original)
+            for t, tile in enumerate(tiles):
+                entry = self.encode_photo(tile, original if len(tiles) == 1 else None)
+                entry["digest"] = digest if len(tiles) == 1 else f"{digest}:{t}"
+                base64_images.append(entry)
+
+        if not base64_images:
+            # nothing could be fetched or read: fail rather than ask the model about an empty menu
+            raise ValueError("No usable menu input in: " + ", ".join(url for url, _, _ in fetched))
+        metrics.observe("menu_images_per_request", sum(1 for entry in base64_images if "image" in entry))
+        metrics.count("menu_image_payload_bytes_total", sum(len(entry.get("image", "")) for entry in base64_images))
+        return base64_images
+
+    def build_messages(self, system_instruction_prompt, menu_extraction_prompt, base64_images):
+        """Assembles the chat messages sent to the model.
 
-        messages = [
-            {"role": "system", "content": system_instruction_prompt},
+        All instructions go into the system message, which is the same for every menu, so the provider
+        can serve it from its prompt cache; the images and text pages of the menu come last.
+        """
+        messages = prefix_messages(system_instruction_prompt, menu_extraction_prompt) + [
             {
                 "role": "user",
-                "content": [menu_extraction_prompt] + base64_images
+                "content": base64_images
             }
         ]
-        
+
         return messages
 
-    def menu_builder(self, urls):
-        messages = self.generate_gpt_messages(self.system_instruction_prompt, self.menu_extraction_prompt, self.extraction_examples, urls)  
-        response = self.chat_agent.get_response(messages)
+    def generate_gpt_messages(self, system_instruction_prompt, menu_extraction_prompt, extraction_examples, urls):
+        fetched = self.fetch_inputs(urls)
+        base64_images = self.preprocess_inputs(fetched)
+
+        return self.build_messages(system_instruction_prompt, menu_extraction_prompt, base64_images)
+
+    def extract_shard(self, entries, priority=None, use_hash_index=True, restaurant_id=None):
+        """Gets the model response for one shard (or a whole request), reusing the result of the same single image
+        of the same restaurant.
+
+        use_hash_index=False always asks the model, for callers that keep their own per-page results.
+        """
+        digest = None
+        if use_hash_index and self.hash_index is not None and restaurant_id is not None:
+            digest = single_image_digest(entries)
+        if digest is not None:
+            known = self.hash_index.lookup(restaurant_id, digest)
+            if known is not None:
+                return known
+
+        messages = self.build_messages(self.system_instruction_prompt, self.menu_extraction_prompt, entries)
+        response = self.chat_agent.get_response(messages, priority)
+        if digest is not None and response:
+            self.hash_index.add(restaurant_id, digest, response)
+        return response
+
+    def extract(self, base64_images, priority=None, restaurant_id=None):
+        """Runs the model over preprocessed inputs: one call, or one concurrent call per shard of pages.
+
+        The hash index is only used when the restaurant is known.
+        """
+        if self.triage is not None:
+            screened = self.triage.screen(base64_images, priority)
+            if screened is not None:
+                return json.dumps(screened)
+
+        shards = shard_entries(base64_images, self.pages_per_shard) if self.sharded else []
+        if len(shards) <= 1:
+            return self.extract_shard(base64_images, priority, restaurant_id=restaurant_id)
+
+        metrics.observe("menu_shards_per_request", len(shards))
+        with ThreadPoolExecutor(max_workers=min(len(shards), self.max_shard_concurrency)) as pool:
+            responses = list(pool.map(lambda shard: self.extract_shard(shard, priority, restaurant_id=restaurant_id),
+                                      shards))
+
+        return json.dumps(merge_shard_outputs(parse_shard_responses(responses)))
+
+    def menu_builder_stream(self, urls, cancel_invalid=True):
+        """Streams the model output as parser events (see IncrementalMenuParser).
+
+        With cancel_invalid, the request is cancelled as soon as the model answers is_valid_menu = "no".
+        """
+        base64_images = self.preprocess_inputs(self.fetch_inputs(urls))
+        screened = self.triage.screen(base64_images) if self.triage is not None else None
+        if screened is not None:
+            for key, value in screened.items():
+                yield ("field", key, value)
+            yield ("end", screened)
+            return
+        messages = self.build_messages(self.system_instruction_prompt, self.menu_extraction_prompt, base64_images)
+        del base64_images
+
+        parser = IncrementalMenuParser()
+        stream = self.chat_agent.stream_response(messages)
+        try:
+            for delta in stream:
+                for event in parser.feed(delta):
+                    yield event
+                    if cancel_invalid and event[:2] == ("field", "is_valid_menu") and event[2] == "no":
+                        return
+        finally:
+            stream.close()
+
+    def menu_builder(self, urls, restaurant_id=None):
+        base64_images = self.preprocess_inputs(self.fetch_inputs(urls))
+        response = self.extract(base64_images, restaurant_id=restaurant_id)
 
         return response
       
 
 
-# remove any items with zero or null price
-def remove_items_with_zero_or_null_price(menu_json):
-    for category in menu_json.get("categories", []):
-        category["items"] = [item for item in category["items"] if item.get("price") not in (0, None)]
-    return menu_json
-  
-# remove a category if it has no items under it
-def remove_empty_categories(menu_json):
-    if "categories" in menu_json:
-        menu_json["categories"] = [category for category in menu_json.get("categories", []) if category.get("items")]
-    return menu_json      
+# columns of the flat menu format
+column_names = ['type', 'name', 'description', 'price', 'num_min_options', 'num_max_options', 'num_free_options']
+
+
+# DataFrame of the flat menu format from column buffers; numbers stay nullable integers (empty in CSV)
+def flat_to_dataframe(flat):
+    import pandas as pd
+
+    return pd.DataFrame({
+        name: pd.array(flat.columns[name], dtype='string' if name in ('type', 'name', 'description') else 'Int64')
+        for name in column_names
+    })
 
 
-# Function to convert JSON to the specified flat format
+# validate and clean a menu_output and flatten it in one pass; returns (clean menu, DataFrame)
+def postprocess_to_flat_format(menu_json, restaurant_id=''):
+    flat = FlatColumns()
+    with metrics.span("postprocess"):
+        menu_json = postprocess_menu(menu_json, flat, restaurant_id)
+    return menu_json, flat_to_dataframe(flat)
+
+
+# DataFrame of the flat menu format of a menu_output, post-processed like postprocess_to_flat_format
 def json_to_flat_format(json_data):
-    
-    # return empty dataframe if input JSON is empty  
-    column_names = ['type', 'name', 'description', 'price', 'num_min_options', 'num_max_options', 'num_free_options']
-    df = pd.DataFrame(columns=column_names)
-    if len(json_data) == 0 or len(json_data['categories']) == 0:
-        return df
-    
-    # Traverse the JSON hierarchy if input JSON is not empty
-    rows = []
-
-    for category in json_data.get('categories', []):
-        category_name = category['name']
-        # Add category row
-        rows.append({
-            'type': 'Category',
-            'name': category_name,
-            'description': '',
-            'price': '',
-            'num_min_options': '',
-            'num_max_options': '',
-            'num_free_options': ''
-        })
-
-        for item in category.get('items', []):
-            item_name = item['name']
-            item_description = item.get('description', '')
-            item_price = item.get('price', 0)
-            # Add item row
-            rows.append({
-                'type': 'Item',
-                'name': item_name,
-                'description': item_description,
-                'price': item_price,
-                'num_min_options': '',
-                'num_max_options': '',
-                'num_free_options': ''
-            })
-
-            for extra in item.get('extras', []):
-                extra_name = extra['name']
-                min_options = extra.get('min_num_options', 0)
-                max_options = extra.get('max_num_options', 0)
-                free_options = extra.get('num_free_options', 0)
-                # Add extra row
-                rows.append({
-                    'type': 'Extra',
-                    'name': extra_name,
-                    'description': '',
-                    'price': '',
-                    'num_min_options': min_options,
-                    'num_max_options': max_options,
-                    'num_free_options': free_options
-                })
-
-                for option in extra.get('options', []):
-                    option_name = option['name']
-                    option_description = option.get('description', '')
-                    option_price = option.get('price', 0)
-                    # Add option row
-                    rows.append({
-                        'type': 'Option',
-                        'name': option_name,
-                        'description': option_description,
-                        'price': option_price,
-                        'num_min_options': '',
-                        'num_max_options': '',
-                        'num_free_options': ''
-                    })
-
-    # Create a DataFrame
-    return pd.DataFrame(rows)
+    return postprocess_to_flat_format(json_data)[1]
+
+
+# post-process categories as they stream in and append them to a CSV file in the flat format;
+# returns the top-level answers (is_valid_menu, menu_complexity, ...) seen in the stream
+def stream_menu_to_csv(events, csv_path):
+    fields = {}
+    sort_id = 0
+    flat = FlatColumns()
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(column_names)
+        for event in events:
+            if event[0] == 'field':
+                fields[event[1]] = event[2]
+            elif event[0] == 'category':
+                flat.clear()
+                menu_json = postprocess_menu({'categories': [event[2]]}, flat, category_offset=sort_id)
+                if not menu_json['categories']:
+                    continue
+                sort_id += 1
+                writer.writerows(['' if value is None else value for value in row]
+                                 for row in zip(*(flat.columns[name] for name in column_names)))
+                f.flush()
+    return fields
 
 
 
@@ -491,7 +679,79 @@ temperature = 0.0
 response_format = {"type": "json_object"}
 model_name = 'gpt-4o'
 
-# initialize the model
-chat_agent = ChatCompletionAgent(model_name, openai_api_key, temperature, response_format)
-menu_builder_model = menuBuilder(system_instruction_prompt, menu_extraction_prompt, extraction_examples, chat_agent)
-
+triage_model_name = 'gpt-4o-mini'
+
+
+# build a menu builder configured from the environment:
+#   YOU_OPENAI_API_KEY                 OpenAI API key
+#   MENU_RESPONSE_CACHE                file path to keep model responses across runs
+#   OPENAI_RPM_LIMIT, OPENAI_TPM_LIMIT rate limits of the OpenAI account (requests and tokens per minute);
+#                                      unset means not limited by the client (429s are still retried)
+#   MENU_TRIAGE                        optional pre-screening of invalid and non-easy menus ("model" or "ocr")
+#   MENU_HASH_INDEX                    file path to reuse earlier results of the exact same image of a restaurant
+#   MENU_DEDUP                         set to drop near-duplicate photos and pages within a request
+#   MENU_FETCH_CACHE                   directory to keep downloads in, so unchanged menus are not downloaded again
+# allow_local_files also reads inputs that are not http(s) URLs from disk, for the command line only
+def create_menu_builder(api_key=None, base_url=None, allow_local_files=False, **builder_options):
+    fingerprint = prompt_fingerprint(system_instruction_prompt, menu_extraction_prompt)
+    response_cache = ResponseCache(
+        path = os.getenv("MENU_RESPONSE_CACHE"),
+        ttl = 30 * 24 * 3600,
+        prompt_fingerprint = fingerprint
+    )
+    scheduler = RequestScheduler(
+        requests_per_minute = int(os.getenv("OPENAI_RPM_LIMIT", 0)) or None,
+        tokens_per_minute = int(os.getenv("OPENAI_TPM_LIMIT", 0)) or None
+    )
+    api_key = api_key or os.getenv("YOU_OPENAI_API_KEY")
+
+    # initialize the model
+    chat_agent = ChatCompletionAgent(model_name, api_key, temperature, response_format, cache=response_cache,
+                                     base_url=base_url, scheduler=scheduler)
+
+    menu_triage = None
+    if os.getenv("MENU_TRIAGE") == "model":
+        triage_agent = ChatCompletionAgent(triage_model_name, api_key, temperature, response_format,
+                                           cache=response_cache, base_url=base_url)
+        menu_triage = MenuTriage("model", chat_agent=triage_agent)
+    elif os.getenv("MENU_TRIAGE") == "ocr":
+        menu_triage = MenuTriage("ocr")
+
+    hash_index = None
+    if os.getenv("MENU_HASH_INDEX"):
+        hash_index = HashIndex(os.getenv("MENU_HASH_INDEX"), prompt_fingerprint = fingerprint)
+
+    if (os.getenv("MENU_FETCH_CACHE") or allow_local_files) and "fetcher" not in builder_options:
+        from fetcher import UrlFetcher
+        builder_options["fetcher"] = UrlFetcher(cache_dir = os.getenv("MENU_FETCH_CACHE"), allow_local_files = allow_local_files)
+
+    builder_options.setdefault("triage", menu_triage)
+    builder_options.setdefault("deduplicator", ImageDeduplicator() if os.getenv("MENU_DEDUP") else None)
+    builder_options.setdefault("hash_index", hash_index)
+    return menuBuilder(system_instruction_prompt, menu_extraction_prompt, extraction_examples, chat_agent,
+                       **builder_options)
+
+
+# store of earlier page results for incremental re-extraction (see incremental.IncrementalExtractor)
+def create_extraction_store(path):
+    return ExtractionStore(path, prompt_fingerprint = prompt_fingerprint(system_instruction_prompt, menu_extraction_prompt, model_name))
+
+
+_menu_builder = None
+_menu_builder_lock = threading.Lock()
+
+
+# the menu builder shared by the process, created on first use
+def get_menu_builder():
+    global _menu_builder
+    with _menu_builder_lock:
+        if _menu_builder is None:
+            _menu_builder = create_menu_builder()
+        return _menu_builder
+
+
+# menu_builder_model used to be created at import time; it is now created when first accessed
+def __getattr__(name):
+    if name == "menu_builder_model":
+        return get_menu_builder()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,158 @@
+import hashlib
+import logging
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+EXIF_ORIENTATION = 0x0112
+# clockwise rotation implied by the EXIF orientation values that only rotate
+EXIF_ROTATIONS = {3: 180, 6: 90, 8: 270}
+
+
+def exif_orientation(image):
+    return image.getexif().get(EXIF_ORIENTATION, 1)
+
+
+def osd_thumbnail(image, max_side):
+    """Returns a downsampled grayscale copy of an image, which is all OSD needs."""
+    if image.format == "JPEG":
+        image.draft("L", (max_side, max_side))  # let the JPEG decoder skip most of the work
+    thumbnail = image.convert("L")
+    thumbnail.thumbnail((max_side, max_side))
+    return thumbnail
+
+
+def detect_rotation(image_bytes, max_side=1200):
+    """Runs Tesseract OSD on a thumbnail and returns (angle, confidence). Usable as a process pool task."""
+    import pytesseract  # imported on first use, it takes pandas with it
+    from PIL import Image
+
+    image = Image.open(BytesIO(image_bytes))
+    osd = pytesseract.image_to_osd(osd_thumbnail(image, max_side), output_type=pytesseract.Output.DICT)
+    return osd.get("rotate", 0), osd.get("orientation_conf", 0)
+
+
+class OrientationDetector:
+    """Fast orientation correction for menu photos.
+
+    EXIF orientation is applied first and, when present, trusted without OCR. Otherwise Tesseract OSD
+    runs on a downsampled grayscale copy, and its result is cached by the hash of the image bytes.
+    With max_workers > 1, OSD runs on a process pool when a request has parallel_min_images or more
+    photos; like PdfRenderer's, the pool spawns workers that re-import the main module, so only enable
+    it from an entry point with an `if __name__ == "__main__":` guard.
+    Every correction reports where the angle came from and how long it took.
+    """
+
+    def __init__(self, max_side=1200, min_confidence=5, cache_size=4096, max_workers=1, parallel_min_images=3):
+        self.max_side = max_side
+        self.min_confidence = min_confidence
+        self.cache_size = cache_size
+        self.max_workers = max_workers
+        self.parallel_min_images = parallel_min_images
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self._pool = None
+
+    def pool(self):
+        with self.lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def cached(self, key):
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        return None
+
+    def remember(self, key, value):
+        with self.lock:
+            self.cache[key] = value
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def apply(self, image, angle, confidence):
+        # Rotate the image by the detected angle (negative to correct it)
+        if (confidence > self.min_confidence) and (angle != 0):  # Only rotate if necessary
+            return image.rotate(-angle, expand=True)
+        return image
+
+    def correct_many(self, images_bytes):
+        """Corrects the rotation of several images (bytes); returns a list of (PIL image, info) tuples."""
+        from PIL import Image, ImageOps
+
+        images = []
+        infos = []
+        keys = []
+        pending = []
+        for i, image_bytes in enumerate(images_bytes):
+            start = time.perf_counter()
+            image = Image.open(BytesIO(image_bytes))
+            key = hashlib.sha1(image_bytes).hexdigest()
+            info = {"source": None, "angle": 0}
+            orientation = exif_orientation(image)
+            if orientation != 1:
+                image = ImageOps.exif_transpose(image)
+                info.update(source="exif", angle=EXIF_ROTATIONS.get(orientation, 0))
+            else:
+                result = self.cached(key)
+                if result is not None:
+                    info.update(source="cache", angle=result[0])
+                    image = self.apply(image, *result)
+                else:
+                    pending.append(i)
+            info["seconds"] = time.perf_counter() - start
+            images.append(image)
+            infos.append(info)
+            keys.append(key)
+
+        start = time.perf_counter()
+        if len(pending) >= self.parallel_min_images and self.max_workers > 1:
+            futures = [self.pool().submit(detect_rotation, images_bytes[i], self.max_side) for i in pending]
+            results = []
+            for future in futures:
+                results.append((future.exception() or future.result(), time.perf_counter() - start))
+        else:
+            results = []
+            for i in pending:
+                try:
+                    result = detect_rotation(images_bytes[i], self.max_side)
+                except Exception as e:
+                    result = e
+                results.append((result, time.perf_counter() - start))
+                start = time.perf_counter()
+
+        for i, (result, seconds) in zip(pending, results):
+            infos[i]["seconds"] += seconds
+            if isinstance(result, Exception):
+                logger.warning("tesseract error: %s", result)
+                infos[i]["source"] = "error"
+                continue
+            self.remember(keys[i], result)
+            infos[i].update(source="osd", angle=result[0])
+            images[i] = self.apply(images[i], *result)
+
+        for info in infos:
+            metrics.observe("menu_stage_seconds", info["seconds"], stage="rotation")
+            metrics.count("menu_rotation_total", source=info["source"])
+            logger.debug("orientation source=%s angle=%s %.1fms", info["source"], info["angle"], info["seconds"] * 1000)
+        return list(zip(images, infos))
+
+    def correct(self, image_bytes):
+        """Corrects the rotation of one image (bytes); returns (PIL image, info)."""
+        return self.correct_many([image_bytes])[0]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
@@ -0,0 +1,213 @@
+import base64
+import math
+import multiprocessing
+import os
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import pymupdf
+from PIL import Image
+
+
+IMAGE_MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+# the document most recently opened by this (worker) process, as (path, document)
+_open_document = None
+
+
+def page_zoom(page_rect, pixel_budget, min_zoom=0.5, max_zoom=4.0):
+    """Chooses the render scale of a page so that it comes out at roughly pixel_budget pixels."""
+    area = max(page_rect.width * page_rect.height, 1.0)
+    zoom = math.sqrt(pixel_budget / area)
+    return min(max(zoom, min_zoom), max_zoom)
+
+
+def encode_pixmap(pix, image_format, quality):
+    """Encodes a rendered page as PNG (lossless), JPEG or WebP bytes."""
+    if image_format == "png":
+        return pix.tobytes("png")
+    if image_format == "jpeg":
+        return pix.tobytes("jpg", jpg_quality=quality)
+    if image_format == "webp":
+        img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+        buffer = BytesIO()
+        img.save(buffer, format="WEBP", quality=quality)
+        return buffer.getvalue()
+    raise ValueError(f"Unsupported image format: {image_format}")
+
+
+def page_text_layout(page, min_chars=200, max_garbage_ratio=0.05):
+    """Returns the text layer of a born-digital page as structured text, or None if the page needs OCR.
+
+    Text is grouped by block with its position (in points from the top left corner) and body font size.
+    Lines set in a larger or bold font are marked, since those are usually category headings.
+    """
+    layout = page.get_text("dict", flags=pymupdf.TEXTFLAGS_TEXT)
+    blocks = []
+    chars = 0
+    garbage = 0
+
+    for block in layout["blocks"]:
+        lines = []
+        for line in block.get("lines", []):
+            spans = [span for span in line["spans"] if span["text"].strip()]
+            if not spans:
+                continue
+            text = " ".join(span["text"].strip() for span in spans)
+            size = max(span["size"] for span in spans)
+            bold = any(span["flags"] & pymupdf.TEXT_FONT_BOLD for span in spans)
+            chars += len(text)
+            garbage += text.count("\ufffd")
+            lines.append((text, size, bold))
+        if lines:
+            blocks.append((block["bbox"], lines))
+
+    if chars < min_chars or garbage > max_garbage_ratio * chars:
+        return None
+
+    out = [f"Page {page.number + 1} text layer ({page.rect.width:.0f}x{page.rect.height:.0f} pt). "
+           f"Blocks are in reading order with position and font size; larger or bold lines are usually headings."]
+    for (x0, y0, _, _), lines in blocks:
+        body_size = min(size for _, size, _ in lines)
+        out.append(f"[block x={x0:.0f} y={y0:.0f} size={body_size:.0f}]")
+        for text, size, bold in lines:
+            marks = []
+            if size >= body_size + 1:
+                marks.append(f"size={size:.0f}")
+            if bold:
+                marks.append("bold")
+            out.append(f"({', '.join(marks)}) {text}" if marks else text)
+    return "\n".join(out)
+
+
+def render_page(document, page_num, pixel_budget, image_format, quality, text_mode="text", min_text_chars=200,
+                text_image_pixel_budget=200_000):
+    """Renders one page of an open document to a list of ("text", str) and ("image", bytes) parts.
+
+    With text_mode "text", pages with a usable text layer are sent as structured text only. With
+    "text+image" they also get a downscaled image, and with "off" every page is rasterized.
+    Scanned pages are always rasterized at pixel_budget.
+    """
+    page = document[page_num]
+    text = page_text_layout(page, min_chars=min_text_chars) if text_mode != "off" else None
+    if text is None:
+        budget = pixel_budget
+    elif text_mode == "text+image":
+        budget = text_image_pixel_budget
+    else:
+        return [("text", text)]
+
+    zoom = page_zoom(page.rect, budget, min_zoom=0.1)
+    pix = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+    image = ("image", encode_pixmap(pix, image_format, quality))
+    return [image] if text is None else [("text", text), image]
+
+
+def render_page_from_file(path, page_num, *args):
+    """Worker entry point: renders one page of the PDF at path, keeping the document open for the next page."""
+    global _open_document
+    if _open_document is None or _open_document[0] != path:
+        if _open_document is not None:
+            _open_document[1].close()
+        _open_document = (path, pymupdf.open(path))
+    return render_page(_open_document[1], page_num, *args)
+
+
+class PdfRenderer:
+    """Rasterizes PDF pages for the model.
+
+    Each page is rendered at the scale that brings it close to pixel_budget pixels, so small and huge
+    pages cost about the same. With max_workers > 1, documents with at least parallel_min_pages pages
+    are rendered on a process pool that is shared between requests. Its workers are spawned and
+    re-import the main module, so only enable it from an entry point with an
+    `if __name__ == "__main__":` guard (cli.py and batch.py do). Pages are yielded in order as they finish, and at
+    most max_in_flight rendered pages are held at once, so memory does not grow with document length.
+    Born-digital pages skip rasterization and are sent as their text layer (see render_page).
+    """
+
+    def __init__(self, pixel_budget=2_000_000, image_format="png", quality=85, max_workers=1,
+                 max_in_flight=None, parallel_min_pages=3, text_mode="text", min_text_chars=200,
+                 text_image_pixel_budget=200_000):
+        if text_mode not in ("off", "text", "text+image"):
+            raise ValueError(f"Unsupported text mode: {text_mode}")
+        if image_format not in IMAGE_MIME_TYPES:
+            raise ValueError(f"Unsupported image format: {image_format}")
+        self.pixel_budget = pixel_budget
+        self.image_format = image_format
+        self.quality = quality
+        self.max_workers = max_workers
+        self.max_in_flight = max_in_flight or 2 * self.max_workers
+        self.parallel_min_pages = parallel_min_pages
+        self.text_mode = text_mode
+        self.min_text_chars = min_text_chars
+        self.text_image_pixel_budget = text_image_pixel_budget
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def render_args(self):
+        return (self.pixel_budget, self.image_format, self.quality, self.text_mode, self.min_text_chars,
+                self.text_image_pixel_budget)
+
+    def to_entries(self, parts):
+        for index, (kind, payload) in enumerate(parts):
+            if kind == "text":
+                yield {"text": payload}
+            else:
+                size = Image.open(BytesIO(payload)).size  # reads the header only
+                entry = {"image": base64.b64encode(payload).decode("ascii"), "mime": IMAGE_MIME_TYPES[self.image_format],
+                         "size": size}
+                if index > 0:
+                    entry["attached"] = True  # preview image of the text page before it
+                yield entry
+
+    def render(self, pdf_content):
+        """Yields base64 image and text entries for each page of a PDF (bytes), in page order."""
+        document = pymupdf.open(stream=pdf_content, filetype="pdf")
+        try:
+            if len(document) < self.parallel_min_pages or self.max_workers == 1:
+                for page_num in range(len(document)):
+                    yield from self.to_entries(render_page(document, page_num, *self.render_args()))
+                return
+            page_count = len(document)
+        finally:
+            document.close()
+
+        yield from self.render_parallel(pdf_content, page_count)
+
+    def render_parallel(self, pdf_content, page_count):
+        # workers open the document from a temporary file instead of receiving the PDF bytes per page
+        fd, path = tempfile.mkstemp(suffix=".pdf")
+        with os.fdopen(fd, "wb") as f:
+            f.write(pdf_content)
+
+        pool = self.pool()
+        in_flight = deque()
+        next_page = 0
+        try:
+            while next_page < page_count or in_flight:
+                while next_page < page_count and len(in_flight) < self.max_in_flight:
+                    in_flight.append(pool.submit(render_page_from_file, path, next_page, *self.render_args()))
+                    next_page += 1
+                yield from self.to_entries(in_flight.popleft().result())
+        finally:
+            for future in in_flight:
+                future.cancel()
+            for future in in_flight:
+                if not future.cancelled():
+                    future.exception()
+            os.unlink(path)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
@@ -0,0 +1,160 @@
+import math
+
+from metrics import metrics
+
+
+def to_cents(value):
+    """Coerces a model price to integer cents, or None if it is missing, negative or not a number.
+
+    The unit follows the type, so all prices of a menu are read the same way: ints and strings of
+    digits are cents (the prompt asks for cents); floats, strings with a decimal point and strings
+    with a "$" are dollars, e.g. 799 -> 799, "799" -> 799, 7.99 -> 799, 8.0 -> 800, "8.00" -> 800, "$7" -> 700.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value if value >= 0 else None
+    if isinstance(value, str):
+        text = value.strip().replace(",", "")
+        dollars = "$" in text or "." in text
+        try:
+            value = float(text.replace("$", ""))
+        except ValueError:
+            return None
+    elif isinstance(value, float):
+        dollars = True
+    else:
+        return None
+    if math.isnan(value) or math.isinf(value) or value < 0:
+        return None
+    return round(value * 100) if dollars else int(value)
+
+
+def as_int(value):
+    """Coerces an option count from the model output to an int (None if it is missing or not a number)."""
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return int(value)
+    try:
+        return round(value if isinstance(value, float) else float(str(value).strip()))
+    except (ValueError, OverflowError):
+        return None
+
+
+def as_count(value):
+    count = as_int(value)
+    return count if count is not None and count >= 0 else 0
+
+
+def as_name(value):
+    if isinstance(value, str):
+        return value.strip()
+    return "" if value is None or isinstance(value, (dict, list)) else str(value)
+
+
+def as_list(value):
+    return value if isinstance(value, list) else []
+
+
+def postprocess_menu(menu_json, flat=None, restaurant_id="", category_offset=0):
+    """Validates and cleans a menu_output in a single pass, optionally emitting its flat rows.
+
+    Every node is checked against the menu schema of the extraction prompt: nodes of the wrong type
+    and items/extras/options without a name are dropped, prices become integer cents, items with a
+    zero or missing price, extras without options and categories without items are dropped, and
+    sort_ids are renumbered. With a FlatColumns buffer, the rows are appended as the menu is walked
+    (the rows of a category are taken back if it ends up empty). Returns the clean menu.
+    """
+    if not isinstance(menu_json, dict):
+        raise ValueError(f"menu_output must be a JSON object, not {type(menu_json).__name__}")
+    if not menu_json:
+        return {}
+    dropped = {"category": 0, "item": 0, "extra": 0, "option": 0}
+
+    categories = []
+    for category in as_list(menu_json.get("categories")):
+        if not isinstance(category, dict):
+            dropped["category"] += 1
+            continue
+        c = category_offset + len(categories)
+        category_name = as_name(category.get("name"))
+        start = len(flat) if flat is not None else 0
+        if flat is not None:
+            flat.append_clean(restaurant_id, "Category", c, None, None, None, category_name, "", None, None, None, None)
+
+        items = []
+        for item in as_list(category.get("items")):
+            name = as_name(item.get("name")) if isinstance(item, dict) else ""
+            price = to_cents(item.get("price")) if name else None
+            if not price:
+                dropped["item"] += 1
+                continue
+            i = len(items)
+            description = as_name(item.get("description"))
+            if flat is not None:
+                flat.append_clean(restaurant_id, "Item", c, i, None, None, name, description, price, None, None, None)
+
+            extras = []
+            for extra in as_list(item.get("extras")):
+                extra_name = as_name(extra.get("name")) if isinstance(extra, dict) else ""
+                raw_options = as_list(extra.get("options")) if extra_name else []
+                if not raw_options:
+                    dropped["extra"] += 1
+                    continue
+                e = len(extras)
+                extra_start = len(flat) if flat is not None else 0
+                clean_extra = {
+                    "name": extra_name,
+                    "min_num_options": as_count(extra.get("min_num_options")),
+                    "max_num_options": as_count(extra.get("max_num_options")),
+                    "num_free_options": as_count(extra.get("num_free_options")),
+                    "options": [],
+                }
+                if flat is not None:
+                    flat.append_clean(restaurant_id, "Extra", c, i, e, None, extra_name, "", None,
+                                      clean_extra["min_num_options"], clean_extra["max_num_options"],
+                                      clean_extra["num_free_options"])
+                options = clean_extra["options"]
+                for option in raw_options:
+                    option_name = as_name(option.get("name")) if isinstance(option, dict) else ""
+                    if not option_name:
+                        dropped["option"] += 1
+                        continue
+                    o = len(options)
+                    option_description = as_name(option.get("description"))
+                    option_price = to_cents(option.get("price")) or 0
+                    options.append({"name": option_name, "description": option_description, "price": option_price,
+                                    "sort_id": o})
+                    if flat is not None:
+                        flat.append_clean(restaurant_id, "Option", c, i, e, o, option_name, option_description,
+                                          option_price, None, None, None)
+                if not options:
+                    dropped["extra"] += 1
+                    if flat is not None:
+                        flat.truncate(extra_start)
+                    continue
+                extras.append(clean_extra)
+
+            items.append({
+                "name": name,
+                "description": description,
+                "price": price,
+                "extras": extras,
+                "is_alcohol": item.get("is_alcohol") is True,
+                "is_bike_friendly": item.get("is_bike_friendly", True) is not False,
+                "sort_id": i,
+            })
+
+        if not items:
+            dropped["category"] += 1
+            if flat is not None:
+                flat.truncate(start)
+            continue
+        categories.append({"name": category_name, "subtitle": as_name(category.get("subtitle")), "sort_id": c,
+                           "items": items})
+
+    for node, count in dropped.items():
+        if count:
+            metrics.count("menu_postprocess_dropped_total", count, node=node)
+    return {"categories": categories}
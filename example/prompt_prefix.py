@@ -0,0 +1,135 @@
+import argparse
+import hashlib
+import json
+import sys
+
+from scheduler import estimate_prompt_tokens
+
+
+# OpenAI caches prompt prefixes of at least this many tokens (in steps of 128)
+MIN_CACHED_PREFIX_TOKENS = 1024
+# chat formatting overhead per message, and for priming the reply
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+
+def api_content_part(part):
+    """Converts an entry of a message content list (prompt text, image or text page) to the API format."""
+    if isinstance(part, str):
+        return {"type": "text", "text": part}
+    if "image" in part:
+        return {"type": "image_url", "image_url": {"url": f"data:{part.get('mime', 'image/png')};base64,{part['image']}"}}
+    return {"type": "text", "text": part["text"]}
+
+
+def api_messages(messages):
+    """Converts chat messages to the API format, dropping the bookkeeping keys (size, digest, ...) of the entries."""
+    converted = []
+    for message in messages:
+        content = message["content"]
+        if not isinstance(content, str):
+            content = [api_content_part(part) for part in content]
+        converted.append({"role": message["role"], "content": content})
+    return converted
+
+
+def write_api_body(f, params, chunk_size=64 * 1024):
+    """Writes a chat completion request body as JSON to a text file, in API format.
+
+    Unlike json.dumps(), this never holds the serialized body in memory: the base64 payload of each
+    image is streamed from its entry in chunks instead of being copied into a data URL and then into
+    the body. Used for request files (e.g. batch submissions); the SDK serializes its own requests.
+    """
+    head = json.dumps({key: value for key, value in params.items() if key != "messages"})
+    f.write(head[:-1] + (", " if head != "{}" else "") + '"messages": [')
+    for m, message in enumerate(params["messages"]):
+        f.write(("" if m == 0 else ", ") + '{"role": ' + json.dumps(message["role"]) + ', "content": ')
+        content = message["content"]
+        if isinstance(content, str):
+            f.write(json.dumps(content))
+        else:
+            f.write("[")
+            for p, part in enumerate(content):
+                if p:
+                    f.write(", ")
+                if isinstance(part, dict) and "image" in part:
+                    f.write('{"type": "image_url", "image_url": {"url": "data:' + part.get("mime", "image/png") + ";base64,")
+                    data = part["image"]
+                    for start in range(0, len(data), chunk_size):
+                        f.write(data[start:start + chunk_size])
+                    f.write('"}}')
+                else:
+                    f.write(json.dumps(api_content_part(part)))
+            f.write("]")
+        f.write("}")
+    f.write("]}")
+
+
+def prefix_messages(system_instruction_prompt, menu_extraction_prompt):
+    """The static part of every extraction request, identical byte for byte across menus."""
+    return [{"role": "system", "content": system_instruction_prompt + menu_extraction_prompt}]
+
+
+def prefix_fingerprint(messages):
+    return hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load_encoding(model_name):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:  # the encoding files are downloaded on first use
+        print(f"could not load the tiktoken encoding ({e}), estimating instead", file=sys.stderr)
+        return None
+
+
+def count_prefix_tokens(messages, model_name):
+    """Counts the tokens of text-only messages with tiktoken, or estimates them when it is unavailable."""
+    encoding = load_encoding(model_name)
+    if encoding is None:
+        return estimate_prompt_tokens(messages), "estimate"
+    tokens = TOKENS_PER_REPLY
+    for message in messages:
+        tokens += TOKENS_PER_MESSAGE + len(encoding.encode(message["role"])) + len(encoding.encode(message["content"]))
+    return tokens, "tiktoken"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Computes the token count of the static prompt prefix and checks it is cacheable.")
+    parser.add_argument("--write", help="Store the prefix fingerprint and token count in this JSON file")
+    parser.add_argument("--check", help="Fail if the prefix differs from the one stored in this JSON file")
+    args = parser.parse_args(argv)
+
+    from model import model_name, system_instruction_prompt, menu_extraction_prompt
+
+    messages = prefix_messages(system_instruction_prompt, menu_extraction_prompt)
+    tokens, method = count_prefix_tokens(messages, model_name)
+    report = {"model": model_name, "prefix_tokens": tokens, "method": method,
+              "fingerprint": prefix_fingerprint(messages)}
+    print(json.dumps(report, indent=2))
+
+    status = 0
+    if tokens < MIN_CACHED_PREFIX_TOKENS:
+        print(f"prefix is shorter than {MIN_CACHED_PREFIX_TOKENS} tokens and will not be cached", file=sys.stderr)
+        status = 1
+    if args.check:
+        with open(args.check, encoding="utf-8") as f:
+            expected = json.load(f)
+        if expected["fingerprint"] != report["fingerprint"]:
+            print(f"prefix changed: {expected['prefix_tokens']} -> {tokens} tokens; cached prefixes are invalidated "
+                  f"(re-run with --write {args.check} if intended)", file=sys.stderr)
+            status = 1
+    if args.write:
+        with open(args.write, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
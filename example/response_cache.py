@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def prompt_fingerprint(*prompts):
+    """Hashes the prompt texts, so cached responses can be dropped when a prompt changes."""
+    h = hashlib.sha256()
+    for prompt in prompts:
+        h.update(prompt.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def content_part_digest(part):
+    """Hashes one entry of a message content list (prompt text, image or text page)."""
+    if isinstance(part, str):
+        return "text:" + hashlib.sha256(part.encode("utf-8")).hexdigest()
+    if "image" in part:
+        return "image:" + hashlib.sha256(part["image"].encode("ascii")).hexdigest()
+    return "part:" + hashlib.sha256(json.dumps(part, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def response_cache_key(model_name, temperature, response_format, messages):
+    """Builds a content-addressed key from the request parameters, prompt texts and image hashes."""
+    h = hashlib.sha256()
+    h.update(json.dumps([model_name, temperature, response_format], sort_keys=True).encode("utf-8"))
+    for message in messages:
+        h.update(message["role"].encode("utf-8"))
+        content = message["content"]
+        parts = [content] if isinstance(content, str) else content
+        for part in parts:
+            h.update(content_part_digest(part).encode("ascii"))
+    return h.hexdigest()
+
+
+class ResponseCache:
+    """Two-tier cache of model responses.
+
+    The first tier is an in-memory LRU bounded by the total size of the cached responses. The optional
+    second tier is a SQLite file shared between runs. Entries can expire after a TTL, and every entry
+    records the fingerprint of the prompts it was produced with: opening the cache with a different
+    fingerprint (i.e. after editing menu_extraction_prompt) drops all entries of the old prompts.
+    """
+
+    def __init__(self, path=None, max_memory_bytes=64 * 1024 * 1024, ttl=None, prompt_fingerprint=None):
+        self.max_memory_bytes = max_memory_bytes
+        self.ttl = ttl
+        self.prompt_fingerprint = prompt_fingerprint or ""
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = None
+
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, prompt_fingerprint TEXT NOT NULL, "
+                "created_at REAL NOT NULL, expires_at REAL)"
+            )
+            self.db.commit()
+            if prompt_fingerprint:
+                self.invalidate_other_prompts(prompt_fingerprint)
+
+    def _remember(self, key, value, expires_at):
+        if key in self.memory:
+            self.memory_bytes -= len(self.memory.pop(key)[0])
+        if len(value) > self.max_memory_bytes:
+            return
+        self.memory[key] = (value, expires_at)
+        self.memory_bytes += len(value)
+        while self.memory_bytes > self.max_memory_bytes:
+            _, (evicted, _) = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def _forget(self, key):
+        if key in self.memory:
+            self.memory_bytes -= len(self.memory.pop(key)[0])
+
+    def get(self, key):
+        """Returns the cached response for key, or None."""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > now:
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._forget(key)
+
+            if self.db is not None:
+                row = self.db.execute(
+                    "SELECT value, expires_at FROM responses WHERE key = ? AND prompt_fingerprint = ?",
+                    (key, self.prompt_fingerprint),
+                ).fetchone()
+                if row is not None:
+                    value, expires_at = row
+                    if expires_at is None or expires_at > now:
+                        self._remember(key, value, expires_at)
+                        self.hits += 1
+                        return value
+                    self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.db.commit()
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self.lock:
+            self._remember(key, value, expires_at)
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, prompt_fingerprint, created_at, expires_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, value, self.prompt_fingerprint, now, expires_at),
+                )
+                self.db.commit()
+
+    def invalidate(self, key):
+        """Drops a single cached response."""
+        with self.lock:
+            self._forget(key)
+            if self.db is not None:
+                self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.db.commit()
+
+    def invalidate_other_prompts(self, fingerprint):
+        """Drops every response that was not produced with the prompts identified by fingerprint."""
+        with self.lock:
+            self.prompt_fingerprint = fingerprint
+            self.memory.clear()
+            self.memory_bytes = 0
+            if self.db is not None:
+                self.db.execute("DELETE FROM responses WHERE prompt_fingerprint != ?", (fingerprint,))
+                self.db.commit()
+
+    def purge_expired(self):
+        with self.lock:
+            now = time.time()
+            for key in [k for k, (_, expires_at) in self.memory.items() if expires_at is not None and expires_at <= now]:
+                self._forget(key)
+            if self.db is not None:
+                self.db.execute("DELETE FROM responses WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+                self.db.commit()
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.memory_bytes = 0
+            if self.db is not None:
+                self.db.execute("DELETE FROM responses")
+                self.db.commit()
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
@@ -0,0 +1,206 @@
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+from image_budget import estimate_image_tokens
+from metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BACKFILL = 1
+
+# tokens of an image entry whose size is unknown (a 2x2 tile image)
+DEFAULT_IMAGE_TOKENS = 765
+
+
+def estimate_prompt_tokens(messages):
+    """Estimates the prompt tokens of a request: ~4 characters per text token plus the vision tiles."""
+    tokens = 0
+    for message in messages:
+        content = message["content"]
+        for part in [content] if isinstance(content, str) else content:
+            if isinstance(part, str):
+                tokens += len(part) // 4
+            elif "image" in part:
+                tokens += estimate_image_tokens(*part["size"]) if "size" in part else DEFAULT_IMAGE_TOKENS
+            else:
+                tokens += len(part.get("text", "")) // 4
+    return tokens
+
+
+class TokenBucket:
+    """A bucket refilled continuously at rate_per_minute, holding at most one minute's worth."""
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until amount can be taken (requests larger than the bucket wait for a full bucket)."""
+        self.refill()
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount):
+        self.refill()
+        self.level -= amount  # may go negative, e.g. when usage exceeds the estimate
+
+
+class AdaptiveConcurrency:
+    """AIMD concurrency limit: +1 per limit-many successes, halved on throttling (at most once per cooldown)."""
+
+    def __init__(self, initial=8, minimum=1, maximum=64, cooldown=2.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.cooldown = cooldown
+        self.last_decrease = 0.0
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def on_throttle(self):
+        now = time.monotonic()
+        if now - self.last_decrease >= self.cooldown:
+            self.limit = max(self.minimum, self.limit / 2)
+            self.last_decrease = now
+
+    def allows(self, in_flight):
+        return in_flight < int(self.limit)
+
+
+def retry_after(error):
+    """Returns the delay requested by a Retry-After(-ms) header of an API error, or None."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+def is_throttle(error):
+    import openai  # already loaded by the client that raised the error
+
+    return isinstance(error, openai.RateLimitError)
+
+
+def is_retryable(error):
+    import openai
+
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class RequestScheduler:
+    """Schedules model calls under the account's RPM/TPM limits.
+
+    Every call waits in a priority queue (INTERACTIVE before BACKFILL, FIFO within a priority) until
+    the request and token buckets can cover it and the adaptive concurrency limit has room. 429s and
+    transient errors (5xx, connection errors, timeouts) are retried with jittered exponential backoff,
+    or after the server's Retry-After, during which all other calls are held back too. Throttling
+    halves the concurrency limit, and successes grow it again one step at a time.
+    Streamed calls hold their concurrency slot until the response starts.
+    A limit of None means no bucket: calls are then only bounded by the concurrency limit.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, max_concurrency=32, initial_concurrency=8,
+                 max_retries=6, base_delay=1.0, max_delay=60.0, completion_tokens=1500):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = AdaptiveConcurrency(initial_concurrency, maximum=max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.completion_tokens = completion_tokens
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.cond = threading.Condition()
+
+    def acquire(self, tokens, priority):
+        with self.cond:
+            ticket = (priority, next(self.sequence))
+            heapq.heappush(self.waiting, ticket)
+            while True:
+                if self.waiting[0] == ticket and self.concurrency.allows(self.in_flight):
+                    wait = max(self.paused_until - time.monotonic(),
+                               self.requests.wait_time(1) if self.requests is not None else 0,
+                               self.tokens.wait_time(tokens) if self.tokens is not None else 0)
+                    if wait <= 0:
+                        heapq.heappop(self.waiting)
+                        if self.requests is not None:
+                            self.requests.take(1)
+                        if self.tokens is not None:
+                            self.tokens.take(tokens)
+                        self.in_flight += 1
+                        self.cond.notify_all()
+                        return
+                    self.cond.wait(wait)
+                else:
+                    self.cond.wait()
+
+    def release(self, throttled=False, retry_delay=None):
+        with self.cond:
+            self.in_flight -= 1
+            if throttled:
+                self.concurrency.on_throttle()
+                if retry_delay:
+                    self.paused_until = max(self.paused_until, time.monotonic() + retry_delay)
+            else:
+                self.concurrency.on_success()
+            metrics.observe("menu_llm_concurrency_limit", self.concurrency.limit)
+            self.cond.notify_all()
+
+    def settle(self, estimated_tokens, used_tokens):
+        """Corrects the token bucket once the actual usage of a call is known."""
+        if self.tokens is None:
+            return
+        with self.cond:
+            self.tokens.take(used_tokens - estimated_tokens)
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def run(self, call, messages, priority=INTERACTIVE):
+        """Runs call() under the limits; returns (result, estimated tokens)."""
+        estimated = estimate_prompt_tokens(messages) + self.completion_tokens
+        for attempt in itertools.count():
+            start = time.perf_counter()
+            self.acquire(estimated, priority)
+            metrics.observe("menu_stage_seconds", time.perf_counter() - start, stage="llm_queue")
+            try:
+                result = call()
+            except Exception as e:
+                throttled = is_throttle(e)
+                delay = retry_after(e)
+                self.release(throttled=throttled, retry_delay=delay)
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = delay if delay is not None else self.backoff(attempt)
+                metrics.count("menu_llm_retries_total", reason="throttled" if throttled else "error")
+                logger.warning("model call failed (%s), retry %d in %.1fs", type(e).__name__, attempt + 1, delay)
+                time.sleep(delay)
+                continue
+            self.release()
+            return result, estimated
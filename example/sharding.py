@@ -0,0 +1,109 @@
+import json
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def shard_entries(base64_images, pages_per_shard=1):
+    """Groups image/text entries into shards of pages_per_shard pages each.
+
+    An entry marked "attached" (the preview image of a text page) stays with the entry before it.
+    """
+    pages = []
+    for entry in base64_images:
+        if entry.get("attached") and pages:
+            pages[-1].append(entry)
+        else:
+            pages.append([entry])
+    return [[entry for page in pages[i:i + pages_per_shard] for entry in page]
+            for i in range(0, len(pages), pages_per_shard)]
+
+
+def normalize_name(name):
+    return " ".join(str(name or "").split()).casefold()
+
+
+def item_key(item):
+    return normalize_name(item.get("name")), item.get("price")
+
+
+def renumber(entries):
+    for sort_id, entry in enumerate(entries):
+        entry["sort_id"] = sort_id
+    return entries
+
+
+def merge_categories(menu_outputs):
+    """Merges the categories of partial menus in page order.
+
+    Categories with the same name (ignoring case and spacing) are joined, which also stitches together
+    categories that continue across a page break; an unnamed category at the top of a page continues
+    the previous one. Items with the same name and price are kept once, and every sort_id is renumbered.
+    """
+    categories = []
+    by_name = {}
+    for menu_output in menu_outputs:
+        for position, category in enumerate((menu_output or {}).get("categories", [])):
+            name = normalize_name(category.get("name"))
+            if name in by_name:
+                target = by_name[name]
+            elif not name and position == 0 and categories:
+                target = categories[-1]
+            else:
+                target = dict(category, items=[])
+                categories.append(target)
+                if name:
+                    by_name[name] = target
+                target["_seen"] = set()
+
+            for item in category.get("items", []):
+                key = item_key(item)
+                if key in target["_seen"]:
+                    continue
+                target["_seen"].add(key)
+                target["items"].append(item)
+
+    for category in categories:
+        del category["_seen"]
+        for item in renumber(category["items"]):
+            for extra in item.get("extras", []):
+                renumber(extra.get("options", []))
+    return {"categories": renumber(categories)} if categories else {}
+
+
+def merge_shard_outputs(partials):
+    """Combines the parsed model outputs of several shards into one output.
+
+    is_valid_menu is "yes" if any shard holds a valid menu, and only valid shards count towards the rest.
+    menu_complexity is "others" if any valid shard says so, in which case menu_output stays empty as the
+    prompt requires. input_quality is the mean of the valid shards. confidence is their minimum, since the
+    weakest page bounds the accuracy of the whole menu.
+    """
+    valid = [p for p in partials if str(p.get("is_valid_menu", "")).lower() == "yes"]
+    if not valid:
+        return {"is_valid_menu": "no", "input_quality": 0, "menu_complexity": "others", "menu_output": {},
+                "confidence": 0}
+
+    complexity = "others" if any(p.get("menu_complexity") != "easy" for p in valid) else "easy"
+    qualities = [p.get("input_quality", 0) or 0 for p in valid]
+    return {
+        "is_valid_menu": "yes",
+        "input_quality": round(sum(qualities) / len(qualities)),
+        "menu_complexity": complexity,
+        "menu_output": merge_categories([p.get("menu_output") for p in valid]) if complexity == "easy" else {},
+        "confidence": min(p.get("confidence", 0) or 0 for p in valid),
+    }
+
+
+def parse_shard_responses(responses):
+    """Parses shard responses, skipping (and logging) the ones that are not valid JSON."""
+    partials = []
+    for index, response in enumerate(responses):
+        try:
+            partials.append(json.loads(response))
+        except (TypeError, ValueError) as e:
+            logger.warning("shard %d returned invalid JSON: %s", index, e)
+    if responses and not partials:
+        raise ValueError("No shard returned a valid JSON response")
+    return partials
@@ -0,0 +1,99 @@
+import json
+
+
+class IncrementalMenuParser:
+    """Incremental parser for the streamed model output.
+
+    Feed it the text deltas of a streamed completion. It reports each top-level answer
+    ("is_valid_menu", "menu_complexity", ...) as soon as its value is complete, and each entry of
+    menu_output.categories as soon as its closing brace arrives, without waiting for the rest of
+    the document. feed() returns a list of events:
+      ("field", key, value)        a top-level key of the output object is complete
+      ("category", index, dict)    a category of menu_output is complete
+      ("end", dict)                the whole output object is complete
+    """
+
+    CATEGORY_PATH = ("menu_output", "categories")
+
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.done = False
+
+    def push(self, kind, start):
+        path = ()
+        if self.stack:
+            parent = self.stack[-1]
+            path = parent["path"] + (parent["key"] if parent["kind"] == "object" else parent["index"],)
+        self.stack.append({"kind": kind, "start": start, "path": path, "key": None, "index": 0,
+                           "expect_key": kind == "object", "scalar_start": None})
+
+    def value_end(self, start, end, events):
+        """Handles a value that spans text[start:end] inside the innermost open container."""
+        if not self.stack:
+            self.done = True
+            events.append(("end", json.loads(self.text[start:end])))
+            return
+        parent = self.stack[-1]
+        if len(self.stack) == 1 and parent["kind"] == "object":
+            events.append(("field", parent["key"], json.loads(self.text[start:end])))
+        elif parent["kind"] == "array" and parent["path"] == self.CATEGORY_PATH and self.text[start] == "{":
+            events.append(("category", parent["index"], json.loads(self.text[start:end])))
+
+    def finish_scalar(self, frame, end, events):
+        if frame["scalar_start"] is not None:
+            start = frame["scalar_start"]
+            frame["scalar_start"] = None
+            self.value_end(start, end, events)
+
+    def feed(self, delta):
+        events = []
+        self.text += delta
+        text = self.text
+
+        for i in range(self.pos, len(text)):
+            c = text[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+                    frame = self.stack[-1] if self.stack else None
+                    if frame is not None and frame["kind"] == "object" and frame["expect_key"]:
+                        frame["key"] = json.loads(text[self.string_start:i + 1])
+                    else:
+                        self.value_end(self.string_start, i + 1, events)
+                continue
+
+            if self.done or c in " \t\r\n":
+                continue
+            if c == '"':
+                self.in_string = True
+                self.string_start = i
+            elif c in "{[":
+                self.push("object" if c == "{" else "array", i)
+            elif c in "}]":
+                frame = self.stack[-1]
+                self.finish_scalar(frame, i, events)
+                self.stack.pop()
+                self.value_end(frame["start"], i + 1, events)
+            elif c == ":":
+                self.stack[-1]["expect_key"] = False
+            elif c == ",":
+                frame = self.stack[-1]
+                self.finish_scalar(frame, i, events)
+                if frame["kind"] == "object":
+                    frame["expect_key"] = True
+                else:
+                    frame["index"] += 1
+            elif self.stack and self.stack[-1]["scalar_start"] is None:
+                self.stack[-1]["scalar_start"] = i  # number, true, false or null
+
+        self.pos = len(text)
+        return events
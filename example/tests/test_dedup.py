@@ -0,0 +1,46 @@
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFont
+
+from dedup import HashIndex, ImageDeduplicator, content_digest, hamming, image_hash, single_image_digest
+
+
+def page(lines):
+    image = Image.new("RGB", (1200, 1600), "white")
+    font = ImageFont.load_default(size=36)
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(lines):
+        draw.text((80, 80 + i * 110), line, fill="black", font=font)
+    return image
+
+
+def test_copy_is_dropped_but_other_pages_are_kept():
+    menu = page([f"Dish {i} .... {10 + i}.99" for i in range(12)])
+    other = page([f"Dessert {i}" for i in range(5)])
+    buffer = BytesIO()
+    menu.save(buffer, format="PNG")
+    kept, hashes = ImageDeduplicator().dedupe([menu, Image.open(buffer), other])
+    assert kept == [menu, other]
+    assert hashes == [image_hash(menu), image_hash(other)]
+
+
+def test_hash_index_needs_the_exact_image(tmp_path):
+    digest = content_digest(b"menu v1")
+    index = HashIndex(str(tmp_path / "index.db"), prompt_fingerprint="fp")
+    index.add("r1", digest, "response of r1")
+    assert index.lookup("r1", digest) == "response of r1"
+    assert index.lookup("r1", content_digest(b"menu v2")) is None
+    assert index.lookup("r2", digest) is None
+
+    reopened = HashIndex(str(tmp_path / "index.db"), prompt_fingerprint="fp")
+    assert reopened.lookup("r1", digest) == "response of r1"
+    assert HashIndex(str(tmp_path / "index.db"), prompt_fingerprint="other").lookup("r1", digest) is None
+
+
+def test_repriced_page_is_a_near_duplicate_but_not_the_same_image():
+    lines = [f"Dish {i} .... {10 + i}.99" for i in range(12)]
+    menu, repriced = page(lines), page(lines[:5] + ["Dish 5 .... 19.49"] + lines[6:])
+    assert hamming(image_hash(menu), image_hash(repriced)) <= 8
+    assert single_image_digest([{"image": "a", "digest": content_digest(menu.tobytes())}]) != \
+        single_image_digest([{"image": "b", "digest": content_digest(repriced.tobytes())}])
+    assert single_image_digest([{"text": "page 1\nx", "digest": "d"}]) is None
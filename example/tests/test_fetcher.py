@@ -0,0 +1,9 @@
+from fetcher import UrlFetcher
+
+
+def test_local_files_are_only_read_when_allowed(tmp_path):
+    path = tmp_path / "menu.pdf"
+    path.write_bytes(b"%PDF-1.4 menu")
+    assert UrlFetcher().fetch(str(path)) == ("unknown", None)
+    assert UrlFetcher().fetch("file://" + str(path)) == ("unknown", None)
+    assert UrlFetcher(allow_local_files=True).fetch("file://" + str(path)) == ("pdf", b"%PDF-1.4 menu")
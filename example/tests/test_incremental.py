@@ -0,0 +1,57 @@
+import json
+
+from incremental import ExtractionStore, IncrementalExtractor, menu_diff, page_digest
+
+
+class FakeBuilder:
+    """Answers every page "<name>:<price>" with a one-item menu, counting the calls."""
+
+    max_shard_concurrency = 4
+
+    def __init__(self):
+        self.calls = 0
+
+    def extract_shard(self, entries, priority=None, use_hash_index=True):
+        assert use_hash_index is False
+        self.calls += 1
+        name, price = entries[0]["text"].split("\n", 1)[1].split(":")
+        return json.dumps({"is_valid_menu": "yes", "menu_complexity": "easy", "input_quality": 4, "confidence": 4,
+                           "menu_output": {"categories": [{"name": "C" + name, "items": [{"name": name, "price": int(price)}]}]}})
+
+
+def pages(items):
+    return [{"text": f"page {i}\n{item}"} for i, item in enumerate(items)]
+
+
+def test_only_changed_pages_are_extracted(tmp_path):
+    builder = FakeBuilder()
+    extractor = IncrementalExtractor(builder, ExtractionStore(str(tmp_path / "store.db"), "fp"))
+    items = [f"dish{i}:{100 + i}" for i in range(12)]
+
+    first, diff = extractor.extract("r1", pages(items))
+    assert builder.calls == 12 and len(diff["added"]) == 12
+
+    again, diff = extractor.extract("r1", pages(items))
+    assert builder.calls == 12 and again == first
+    assert diff == {"added": [], "removed": [], "repriced": []}
+
+    changed = items[1:] + ["new:50"]
+    changed[4] = "dish5:999"
+    _, diff = extractor.extract("r1", pages(changed))
+    assert builder.calls == 14
+    assert [item["name"] for item in diff["added"]] == ["new"]
+    assert [item["name"] for item in diff["removed"]] == ["dish0"]
+    assert diff["repriced"] == [{"category": "Cdish5", "name": "dish5", "old_price": 105, "price": 999}]
+
+
+def test_menu_diff_compares_post_processed_menus():
+    old = {"categories": [{"name": "Mains", "items": [{"name": "Burger", "price": 11.0}]}]}
+    new = {"categories": [{"name": "mains", "items": [{"name": "burger ", "price": 1100}]}]}
+    assert menu_diff(old, new) == {"added": [], "removed": [], "repriced": []}
+
+
+def test_page_digest_follows_the_source_content_not_the_encoding():
+    large = {"image": "AAAA", "mime": "image/jpeg", "size": (768, 1024), "digest": "d1"}
+    small = {"image": "BBBB", "mime": "image/jpeg", "size": (512, 683), "digest": "d1"}
+    assert page_digest([large]) == page_digest([small])
+    assert page_digest([large]) != page_digest([dict(large, digest="d2")])
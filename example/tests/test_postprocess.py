@@ -0,0 +1,91 @@
+import pytest
+
+from flat_format import FlatColumns, FlatMenuWriter
+from model import json_to_flat_format
+from postprocess import postprocess_menu, to_cents
+
+
+@pytest.mark.parametrize("value, cents", [
+    (799, 799),
+    ("799", 799),
+    (7.99, 799),
+    (8.0, 800),
+    (8.5, 850),
+    ("8.00", 800),
+    ("$7", 700),
+    ("$1,299.50", 129950),
+    (0, 0),
+])
+def test_to_cents(value, cents):
+    assert to_cents(value) == cents
+
+
+@pytest.mark.parametrize("value", [None, True, -5, -1.5, "", "free", "nan", float("inf"), [], {}])
+def test_to_cents_rejects(value):
+    assert to_cents(value) is None
+
+
+def test_to_cents_is_consistent_within_a_menu():
+    assert [to_cents(price) for price in [7.99, 8.0, 8.5]] == [799, 800, 850]
+
+
+def menu():
+    return {"categories": [
+        {"name": " Mains ", "items": [
+            {"name": "Burger", "price": 1199, "extras": [
+                {"name": "Sides", "min_num_options": "1", "max_num_options": 2, "options": [
+                    {"name": "Fries", "price": 0},
+                    {"name": "", "price": 100},
+                ]},
+                {"name": "Sauces", "options": []},
+            ]},
+            {"name": "Free water", "price": 0},
+            {"name": "", "price": 500},
+            "not an item",
+        ]},
+        {"name": "Empty", "items": [{"name": "Nothing", "price": None}]},
+        {"name": "Drinks", "items": [{"name": "Beer", "price": "$6", "is_alcohol": True}]},
+    ]}
+
+
+def test_postprocess_menu_cleans_and_renumbers():
+    clean = postprocess_menu(menu())
+    assert [category["name"] for category in clean["categories"]] == ["Mains", "Drinks"]
+    assert [category["sort_id"] for category in clean["categories"]] == [0, 1]
+
+    burger = clean["categories"][0]["items"][0]
+    assert [item["name"] for item in clean["categories"][0]["items"]] == ["Burger"]
+    assert [extra["name"] for extra in burger["extras"]] == ["Sides"]
+    assert burger["extras"][0]["min_num_options"] == 1
+    assert burger["extras"][0]["options"] == [{"name": "Fries", "description": "", "price": 0, "sort_id": 0}]
+
+    beer = clean["categories"][1]["items"][0]
+    assert beer["price"] == 600 and beer["is_alcohol"] is True and beer["is_bike_friendly"] is True
+
+
+def test_postprocess_menu_emits_rows_of_kept_nodes_only():
+    flat = FlatColumns()
+    postprocess_menu(menu(), flat, "r1", category_offset=3)
+    assert flat.columns["type"] == ["Category", "Item", "Extra", "Option", "Category", "Item"]
+    assert flat.columns["name"] == ["Mains", "Burger", "Sides", "Fries", "Drinks", "Beer"]
+    assert flat.columns["category_sort_id"] == [3, 3, 3, 3, 4, 4]
+    assert flat.columns["price"] == [None, 1199, None, 0, None, 600]
+    assert set(flat.columns["restaurant_id"]) == {"r1"}
+
+
+def test_postprocess_menu_empty_and_invalid():
+    assert postprocess_menu({}) == {}
+    assert postprocess_menu({"categories": "nope"}) == {"categories": []}
+    with pytest.raises(ValueError):
+        postprocess_menu(["not", "a", "menu"])
+
+
+def test_flatteners_read_prices_like_postprocess_menu(tmp_path):
+    menu = {"categories": [{"name": "Mains", "items": [{"name": "Burger", "price": 7.99}, {"name": "Water", "price": 0}]}]}
+    assert list(json_to_flat_format(menu)["price"].dropna()) == [799]
+    assert len(json_to_flat_format({})) == 0
+
+    with FlatMenuWriter(str(tmp_path / "menus.csv")) as writer:
+        writer.write_menu(menu, "r1")
+    rows = (tmp_path / "menus.csv").read_text().splitlines()
+    assert len(rows) == 3 and rows[2].startswith("r1,Item,0,0,") and ",799," in rows[2]
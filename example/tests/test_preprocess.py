@@ -0,0 +1,61 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+from dedup import HashIndex
+from image_budget import ImageBudget
+from model import menuBuilder
+
+
+class FakeChatAgent:
+    def __init__(self):
+        self.calls = 0
+
+    def get_response(self, messages, priority=None):
+        self.calls += 1
+        return f"response {self.calls}"
+
+
+def builder(**options):
+    return menuBuilder("system", "prompt", [], chat_agent=FakeChatAgent(), **options)
+
+
+def photo(lines, size=(600, 800), border=False):
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    if border:
+        draw.rectangle((0, 0, size[0] - 1, size[1] - 1), outline="black", width=4)
+    for i, line in enumerate(lines):
+        draw.text((40, 40 + i * 60), line, fill="black", font=ImageFont.load_default(size=24))
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_no_usable_input_raises():
+    fetched = [("https://example.com/missing.jpg", "unknown", None), ("https://example.com/menu.txt", "text", b"x")]
+    with pytest.raises(ValueError, match="No usable menu input"):
+        builder().preprocess_inputs(fetched)
+
+
+def test_hash_index_reuses_only_the_exact_image(tmp_path):
+    menu_builder = builder(hash_index=HashIndex(str(tmp_path / "index.db")))
+    lines = [f"Dish {i} with fries and a drink .... {10 + i}.99" for i in range(4)]
+    menu = menu_builder.preprocess_inputs([("menu.png", "image", photo(lines))])
+    repriced = menu_builder.preprocess_inputs([("menu.png", "image", photo(lines[:-1] + ["Dish 3 with fries and a drink .... 18.49"]))])
+
+    assert len(menu) == len(repriced) == 1
+    assert menu_builder.extract(menu, restaurant_id="r1") == "response 1"
+    assert menu_builder.extract(menu, restaurant_id="r1") == "response 1"
+    assert menu_builder.extract(repriced, restaurant_id="r1") == "response 2"
+    assert menu_builder.chat_agent.calls == 2
+
+
+def test_digest_does_not_change_with_the_image_budget():
+    menu_builder = builder(image_budget=ImageBudget(max_request_tokens=2000))
+    pages = [photo([f"Page {i}"], size=(1200, 1600), border=True) for i in range(3)]
+    alone = menu_builder.preprocess_inputs([("p0.png", "image", pages[0])])
+    together = menu_builder.preprocess_inputs([(f"p{i}.png", "image", page) for i, page in enumerate(pages)])
+    assert alone[0]["size"] != together[0]["size"]
+    assert alone[0]["digest"] == together[0]["digest"]
@@ -0,0 +1,21 @@
+import time
+
+from scheduler import RequestScheduler, estimate_prompt_tokens
+
+
+def test_no_limits_never_wait():
+    scheduler = RequestScheduler(initial_concurrency=4)
+    messages = [{"role": "user", "content": [{"image": "", "size": (2048, 2048)}]}]
+    start = time.monotonic()
+    for _ in range(50):
+        _, estimated = scheduler.run(lambda: None, messages)
+        scheduler.settle(estimated, 10 * estimated)
+    assert time.monotonic() - start < 1
+
+
+def test_token_limit_holds_calls_back():
+    scheduler = RequestScheduler(tokens_per_minute=6000, completion_tokens=0)
+    messages = [{"role": "user", "content": "x" * 4 * 5000}]
+    assert estimate_prompt_tokens(messages) == 5000
+    scheduler.run(lambda: None, messages)
+    assert scheduler.tokens.wait_time(5000) > 30
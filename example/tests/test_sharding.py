@@ -0,0 +1,42 @@
+from sharding import merge_shard_outputs, shard_entries
+
+
+def output(categories, complexity="easy", quality=4, confidence=4, valid="yes"):
+    return {"is_valid_menu": valid, "input_quality": quality, "menu_complexity": complexity,
+            "menu_output": {"categories": categories}, "confidence": confidence}
+
+
+def item(name, price):
+    return {"name": name, "price": price, "sort_id": 9}
+
+
+def test_shard_entries_keeps_attached_previews_with_their_page():
+    entries = [{"text": "p1"}, {"image": "a", "attached": True}, {"text": "p2"}, {"image": "b"}]
+    assert shard_entries(entries, 1) == [entries[:2], [entries[2]], [entries[3]]]
+    assert shard_entries(entries, 2) == [entries[:3], [entries[3]]]
+
+
+def test_merge_joins_categories_across_pages():
+    merged = merge_shard_outputs([
+        output([{"name": "Mains", "items": [item("Burger", 1100)]}], quality=4, confidence=5),
+        output([{"name": "", "items": [item("Steak", 2500)]},
+                {"name": "MAINS ", "items": [item("burger", 1100), item("Fish", 1800)]},
+                {"name": "Drinks", "items": [item("Cola", 300)]}], quality=2, confidence=3),
+    ])
+    categories = merged["menu_output"]["categories"]
+    assert [category["name"] for category in categories] == ["Mains", "Drinks"]
+    assert [i["name"] for i in categories[0]["items"]] == ["Burger", "Steak", "Fish"]
+    assert [i["sort_id"] for i in categories[0]["items"]] == [0, 1, 2]
+    assert [category["sort_id"] for category in categories] == [0, 1]
+    assert merged["input_quality"] == 3 and merged["confidence"] == 3
+
+
+def test_merge_ignores_invalid_shards_and_respects_complexity():
+    invalid = output([], valid="no", quality=0, confidence=0)
+    merged = merge_shard_outputs([invalid, output([{"name": "A", "items": [item("x", 1)]}])])
+    assert merged["is_valid_menu"] == "yes" and merged["confidence"] == 4
+
+    others = merge_shard_outputs([output([{"name": "A", "items": [item("x", 1)]}]), output([], complexity="others")])
+    assert others["menu_complexity"] == "others" and others["menu_output"] == {}
+
+    assert merge_shard_outputs([invalid])["is_valid_menu"] == "no"
@@ -0,0 +1,54 @@
+import json
+
+from streaming import IncrementalMenuParser
+
+
+DOCUMENT = {
+    "is_valid_menu": "yes",
+    "input_quality": 4,
+    "menu_complexity": "easy",
+    "menu_output": {"categories": [
+        {"name": "Mains \"hot\" {x}", "items": [{"name": "Burger", "price": 1100, "extras": []}]},
+        {"name": "Drinks", "items": [{"name": "Cola", "price": 300, "is_alcohol": False}]},
+    ]},
+    "confidence": 5,
+}
+
+
+def parse(text, chunk_size):
+    parser = IncrementalMenuParser()
+    events = []
+    for i in range(0, len(text), chunk_size):
+        events.extend(parser.feed(text[i:i + chunk_size]))
+    return events
+
+
+def test_events_do_not_depend_on_chunking():
+    text = json.dumps(DOCUMENT, indent=1)
+    expected = parse(text, len(text))
+    for chunk_size in (1, 3, 17):
+        assert parse(text, chunk_size) == expected
+
+
+def test_reports_fields_categories_and_end():
+    events = parse(json.dumps(DOCUMENT), 5)
+    categories = DOCUMENT["menu_output"]["categories"]
+    assert ("field", "is_valid_menu", "yes") in events
+    assert ("field", "input_quality", 4) in events
+    assert [event for event in events if event[0] == "category"] == [("category", 0, categories[0]),
+                                                                     ("category", 1, categories[1])]
+    assert events[-1] == ("end", DOCUMENT)
+
+
+def test_category_arrives_before_the_document_ends():
+    text = json.dumps(DOCUMENT)
+    cut = text.index('{"name": "Drinks"')
+    parser = IncrementalMenuParser()
+    events = parser.feed(text[:cut])
+    assert ("category", 0, DOCUMENT["menu_output"]["categories"][0]) in events
+    assert not any(event[0] == "end" for event in events)
+
+
+def test_invalid_answer_is_reported_first():
+    events = parse('{"is_valid_menu": "no", "menu_output": {}}', 4)
+    assert events[0] == ("field", "is_valid_menu", "no")
@@ -0,0 +1,29 @@
+import pytest
+
+from triage import COMPLEX_MENU_PATTERN, PRICE_PATTERN, MenuTriage
+
+
+@pytest.mark.parametrize("text, prices", [
+    ("Burger 11\nFries 5\nSalad 9", 3),
+    ("Burger $11 Fries $5 Salad $9", 3),
+    ("Burger ...... 11.50\nFries 4,50", 2),
+    ("Open since 1998\nCall 555 1234", 0),
+])
+def test_price_pattern(text, prices):
+    assert len(PRICE_PATTERN.findall(text)) == prices
+
+
+@pytest.mark.parametrize("text, complex_menu", [
+    ("DINNER\nLarge Fries 5\nExtra Crispy Wings 9\nSelect wines by the glass", False),
+    ("Burger 11\nChoice of side: fries or salad", True),
+    ("Pizza 12\nToppings $1 each", True),
+    ("Coffee\nSmall / Medium / Large", True),
+])
+def test_complex_menu_pattern(text, complex_menu):
+    assert bool(COMPLEX_MENU_PATTERN.search(text)) == complex_menu
+
+
+def test_ocr_triage_accepts_whole_dollar_menus():
+    verdict = MenuTriage("ocr").ask_ocr([{"text": "DINNER\nBurger 11\nLarge Fries 5\nSalad 9"}])
+    assert verdict["is_valid_menu"] == "yes"
+    assert verdict["menu_complexity"] == "easy"
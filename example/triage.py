@@ -0,0 +1,147 @@
+import base64
+import json
+import logging
+import re
+from io import BytesIO
+
+from metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+triage_prompt = """
+You are given images (and possibly text pages) of what should be a restaurant menu. Do not extract the menu.
+Answer with a JSON object: {"is_valid_menu": "yes", "input_quality": 50, "menu_complexity": "easy"}
+1. is_valid_menu: "yes" if at least one input is a restaurant menu with item prices, otherwise "no".
+2. input_quality: 0-100, how legible and complete the menu is (0 if it is not a valid menu).
+3. menu_complexity: "easy" or "others". Answer "others" if any item offers choices a consumer can make:
+   extras, options, add-ons, toppings, sides to choose, sizes, "choice of", "choose", "select",
+   "build your own", or separate breakfast/lunch/dinner menus. Otherwise answer "easy".
+"""
+
+# wording of choices a consumer makes (extras/options, question 3 of the extraction prompt); plain words
+# like "dinner", "large" or "extra" are left out, they are as likely a heading or part of an item name
+COMPLEX_MENU_PATTERN = re.compile(
+    r"\b(?:choice of|your choice|(?:choose|select|pick) (?:a|an|one|two|three|any|your|from|up to)\b|"
+    r"add[- ]?ons?\b|toppings?\b|build your own|make it a\b|upgrade to\b|substitute|sizes?\s*:|"
+    r"small\s*/\s*(?:medium\s*/\s*)?large\b)",
+    re.IGNORECASE,
+)
+# prices with cents (11.50, $11.50, 11,50), whole dollars after a "$" ($11), and whole dollars at the
+# end of a line after an item name ("Burger 11", "Burger .... 11"), which the extraction prompt calls common
+PRICE_PATTERN = re.compile(
+    r"(?<![\d.])\$?\d{1,3}[.,]\d{2}(?!\d)"
+    r"|\$\s?\d{1,4}(?![\d.,])"
+    r"|(?<=[^\W\d_)][ \t.])[ \t.]*\d{1,3}[ \t]*$",
+    re.MULTILINE,
+)
+# position/font annotations of PDF text-layer entries (see pdf_render.page_text_layout)
+LAYOUT_MARKUP_PATTERN = re.compile(r"^(Page \d+ text layer .*|\[block [^\]]*\]|\((?:size=\d+)?(?:, )?(?:bold)?\) )", re.MULTILINE)
+
+
+def thumbnail(entry, max_side):
+    """Decodes an image entry and returns a downscaled grayscale copy."""
+    from PIL import Image
+
+    image = Image.open(BytesIO(base64.b64decode(entry["image"])))
+    image.draft("L", (max_side, max_side))
+    image = image.convert("L")
+    image.thumbnail((max_side, max_side))
+    return image
+
+
+def thumbnail_entry(entry, max_side):
+    image = thumbnail(entry, max_side)
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=80)
+    return {"image": base64.b64encode(buffer.getbuffer()).decode("ascii"), "mime": "image/jpeg", "size": image.size}
+
+
+class MenuTriage:
+    """Cheap pre-screening that answers "is it a valid menu?" and "is it an easy menu?" before extraction.
+
+    mode "model" sends 512px thumbnails (text pages as they are) with a short prompt to a cheaper model.
+    mode "ocr" runs Tesseract on the thumbnails locally and applies keyword heuristics: a valid menu
+    needs at least min_prices price-like tokens, and menus mentioning choices, add-ons or sizes are
+    "others". Only menus that come out valid and "easy" go on to the full extraction call; for the rest
+    screen() returns the final answer (with an empty menu_output, as the extraction prompt requires,
+    and the screening quality score as confidence).
+    """
+
+    def __init__(self, mode="model", chat_agent=None, max_side=512, ocr_max_side=1600, min_prices=3):
+        if mode not in ("model", "ocr"):
+            raise ValueError(f"Unsupported triage mode: {mode}")
+        if mode == "model" and chat_agent is None:
+            raise ValueError("Triage mode 'model' needs a chat agent")
+        self.mode = mode
+        self.chat_agent = chat_agent
+        self.max_side = max_side
+        self.ocr_max_side = ocr_max_side
+        self.min_prices = min_prices
+
+    def ask_model(self, base64_images, priority=None):
+        content = []
+        for entry in base64_images:
+            if "image" in entry:
+                content.append(thumbnail_entry(entry, self.max_side))
+            elif not entry.get("attached"):
+                content.append(entry)
+        messages = [{"role": "system", "content": triage_prompt}, {"role": "user", "content": content}]
+        answer = json.loads(self.chat_agent.get_response(messages, priority))
+        return {
+            "is_valid_menu": answer.get("is_valid_menu", "yes"),
+            "input_quality": answer.get("input_quality", 0),
+            "menu_complexity": answer.get("menu_complexity", "easy"),
+        }
+
+    def ask_ocr(self, base64_images):
+        texts = []
+        confidences = []
+        for entry in base64_images:
+            if "text" in entry:
+                texts.append(LAYOUT_MARKUP_PATTERN.sub("", entry["text"]))
+                confidences.append(100)
+                continue
+            import pytesseract  # imported on first use, it takes pandas with it
+
+            data = pytesseract.image_to_data(thumbnail(entry, self.ocr_max_side), output_type=pytesseract.Output.DICT)
+            lines = {}  # the OCR lines, so a price at the end of a line can be told from any number
+            confidence_sum = 0
+            for i, word in enumerate(data["text"]):
+                if word.strip():
+                    lines.setdefault((data["block_num"][i], data["par_num"][i], data["line_num"][i]), []).append(word)
+                    confidence_sum += float(data["conf"][i])
+            words = sum(len(line) for line in lines.values())
+            texts.append("\n".join(" ".join(line) for line in lines.values()))
+            confidences.append(confidence_sum / words if words else 0)
+
+        text = "\n".join(texts)
+        is_valid = len(PRICE_PATTERN.findall(text)) >= self.min_prices
+        return {
+            "is_valid_menu": "yes" if is_valid else "no",
+            "input_quality": round(max(confidences, default=0)) if is_valid else 0,
+            "menu_complexity": "others" if COMPLEX_MENU_PATTERN.search(text) else "easy",
+        }
+
+    def screen(self, base64_images, priority=None):
+        """Returns None if the menu should be extracted, otherwise the final output (as a dict)."""
+        try:
+            with metrics.span("triage", mode=self.mode):
+                verdict = self.ask_model(base64_images, priority) if self.mode == "model" else self.ask_ocr(base64_images)
+        except Exception as e:
+            logger.warning("triage failed, falling back to full extraction: %s", e)
+            return None
+
+        passed = verdict["is_valid_menu"] == "yes" and verdict["menu_complexity"] == "easy"
+        metrics.count("menu_triage_total", mode=self.mode, result="extract" if passed else "skip")
+        if passed:
+            return None
+        valid = verdict["is_valid_menu"] == "yes"
+        return {
+            "is_valid_menu": verdict["is_valid_menu"],
+            "input_quality": verdict["input_quality"] if valid else 0,
+            "menu_complexity": verdict["menu_complexity"],
+            "menu_output": {},
+            "confidence": verdict["input_quality"] if valid else 0,
+        }